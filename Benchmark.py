@@ -0,0 +1,60 @@
+from CriptoTassametro.BinanceHistoryParser import BinanceHistoryParser, HistoryColumns, parse_files
+from CriptoTassametro.SyntheticPriceSource import SyntheticPriceSource, synthetic_history
+from CriptoTassametro.OperationsDatabase import OperationsDatabase
+from CriptoTassametro.Portfolio import Portfolio
+from CriptoTassametro.Tassametro import Tassametro
+from datetime import datetime
+import tempfile
+import time
+import os
+
+# measures the throughput of the parser and of the calculator using synthetic prices,
+# so that it can run on any machine without network and without a prices cache.
+# The history is generated with trades at the synthetic prices, when a real history file is given
+# only parse_files is measured as its trades do not match the synthetic prices
+# usage:
+#   python Benchmark.py --trades 5000
+#   python Benchmark.py binance_history_example.csv
+
+
+def measure(name: str, count: int, unit: str, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {count} {unit} in {elapsed:.3f}s ({count / elapsed:.0f} {unit}/s)")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure parser and calculator throughput with synthetic prices')
+    parser.add_argument('binance_history_file', type=str, nargs='?', default=None, help='path to a binance history csv file')
+    parser.add_argument('--trades', type=int, default=2000, help='number of trades of the synthetic history')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic prices and history')
+    args = parser.parse_args()
+
+    prices = SyntheticPriceSource(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        historyFile = args.binance_history_file
+        if historyFile is None:
+            historyFile = os.path.join(folder, 'history.csv')
+            with open(historyFile, 'w') as f:
+                f.write("\n".join(synthetic_history(prices, datetime(2023, 1, 1), args.trades, args.seed)) + "\n")
+        with open(historyFile) as f:
+            lines = sum(1 for _ in f) - 1
+
+        historyEntries = measure("parse_files", lines, "lines", lambda: list(parse_files([historyFile])))
+        columns = measure("load_columns", lines, "lines", lambda: HistoryColumns.load([historyFile]))
+        if args.binance_history_file is None:
+            operationsDb = OperationsDatabase(os.path.join(folder, 'operations.sqlite'))
+            opParser = BinanceHistoryParser(prices, operationsDb)
+            measure("parse_operations", len(historyEntries), "entries",
+                    lambda: opParser.parse_operations(historyEntries, historyFile))
+            columnsParser = BinanceHistoryParser(prices, OperationsDatabase(os.path.join(folder, 'operations_columns.sqlite')))
+            measure("parse_columns", len(columns), "entries",
+                    lambda: columnsParser.parse_columns(columns, historyFile))
+            operationsDb.save()
+            operations = operationsDb.get_operations()
+            tassametro = Tassametro(datetime(2023, 1, 1), datetime.max, prices, Portfolio())
+            measure("process_operations", len(operations), "operations",
+                    lambda: tassametro.process_operations(operations))
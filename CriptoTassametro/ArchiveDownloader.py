@@ -0,0 +1,100 @@
+import os
+import time as systime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+import requests
+from .ArchiveManifest import ArchiveManifest
+
+ARCHIVE_BASE_URL = "https://data.binance.vision/data/spot/monthly/klines"
+
+
+class ArchiveDownloader:
+    ''' Downloads the monthly kline archives of https://data.binance.vision to the files cache.
+        Format of the urls is {baseUrl}/PIVXETH/1m/PIVXETH-1m-2018-02.zip
+        Many archives can be downloaded in parallel with download_all.
+        When a manifest is given the archives known to be missing are never requested again,
+        binance publishes the same months for every interval so the manifest applies to all of them. '''
+
+    def __init__(self, cacheDir: str,
+                 baseUrl: str = ARCHIVE_BASE_URL,
+                 maxWorkers: int = 8,
+                 retries: int = 3,
+                 retryDelay: float = 1.0,  # seconds, doubled at each retry
+                 timeout: float = 60,
+                 manifest: ArchiveManifest = None):
+        self.cache_dir = cacheDir
+        self.base_url = baseUrl.rstrip("/")
+        self.max_workers = maxWorkers
+        self.retries = retries
+        self.retry_delay = retryDelay
+        self.timeout = timeout
+        self.manifest = manifest
+
+    @staticmethod
+    def archive_name(pair: str, year: int, month: int, interval: str = "1m") -> str:
+        return f"{pair}-{interval}-{year}-{month:02}"
+
+    def url(self, pair: str, year: int, month: int, interval: str = "1m") -> str:
+        return f"{self.base_url}/{pair}/{interval}/{ArchiveDownloader.archive_name(pair, year, month, interval)}.zip"
+
+    def cached_file(self, pair: str, year: int, month: int, interval: str = "1m") -> str:
+        return os.path.join(self.cache_dir, ArchiveDownloader.archive_name(pair, year, month, interval) + ".zip")
+
+    def is_missing(self, pair: str, year: int, month: int, interval: str = "1m") -> bool:
+        '''True if the archive is known not to exist'''
+        return self.manifest is not None and self.manifest.is_archive_missing(pair, year, month)
+
+    def get_cached(self, pair: str, year: int, month: int, interval: str = "1m") -> str:
+        '''path of the archive if it has already been downloaded, None otherwise'''
+        if self.is_missing(pair, year, month, interval):
+            return None
+        file = self.cached_file(pair, year, month, interval)
+        return file if os.path.exists(file) else None
+
+    def download(self, pair: str, year: int, month: int, interval: str = "1m") -> str:
+        '''download the archive ( if not already in cache ) and return its path, None if it does not exist'''
+        if self.is_missing(pair, year, month, interval):
+            return None
+        file = self.cached_file(pair, year, month, interval)
+        if os.path.exists(file):
+            return file
+        url = self.url(pair, year, month, interval)
+        error = None
+        for attempt in range(self.retries):
+            try:
+                response = requests.get(url, timeout=self.timeout)
+                if response.status_code == 404:
+                    if self.manifest is not None:
+                        self.manifest.add_missing_archive(pair, year, month)
+                    return None
+                response.raise_for_status()
+                # write to a temporary file first so that an interrupted download is never used
+                with open(file + ".tmp", "wb") as f:
+                    f.write(response.content)
+                os.replace(file + ".tmp", file)
+                if self.manifest is not None:
+                    self.manifest.add_archive(pair, year, month)
+                return file
+            except requests.RequestException as e:
+                error = e
+                systime.sleep(self.retry_delay * 2 ** attempt)
+        print(f"Unable to download {url}: {error}")
+        return None
+
+    def download_all(self,
+                     archives: list[tuple[str, int, int]],
+                     progress: Callable[[int, int, str], None] = None,
+                     interval: str = "1m") -> dict[tuple[str, int, int], str]:
+        '''download in parallel all the (pair, year, month) archives, returns the path of each one ( None if missing ).
+           progress is called with (completed, total, archive name) after each download'''
+        archives = sorted(set(archives))
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download, pair, year, month, interval): (pair, year, month)
+                       for pair, year, month in archives}
+            for future in as_completed(futures):
+                archive = futures[future]
+                results[archive] = future.result()
+                if progress is not None:
+                    progress(len(results), len(archives), ArchiveDownloader.archive_name(*archive, interval))
+        return results
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from .MinuteStore import epoch_minute, minutes_in_month, month_index
+
+MANIFEST_VERSION = 1
+# binance publishes the archive of a month some days after its end, more recent archives are never recorded as missing
+ARCHIVE_PUBLISH_DELAY = timedelta(days=7)
+
+
+class ArchiveManifest:
+    ''' Persistent record of the prices that binance does not have, so that lookups that can not succeed
+        end without any network or disk access. For each pair it keeps:
+        - the months whose archive is missing on data.binance.vision and the first and last month with an archive,
+          a month before a missing one that precedes the first archive ( or after a missing one that follows
+          the last archive ) is outside the listing period and is considered missing too
+        - the listing period from binance api, first and last minute with a kline ( None when unknown or still listed ) '''
+
+    def __init__(self, manifestFile: str):
+        self.file = manifestFile
+        self.missing_archives: dict[str, set[int]] = {}  # pair -> month indexes, see month_index
+        self.archive_months: dict[str, list[int]] = {}  # pair -> [first, last] month index with an archive
+        self.listings: dict[str, list[int]] = {}  # pair -> [first, last] minute
+        self.dirty = False
+        self.lock = threading.Lock()  # archives are downloaded by many threads
+        if os.path.exists(manifestFile):
+            with open(manifestFile, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.missing_archives = {pair: set(months) for pair, months in manifest["missing_archives"].items()}
+                self.archive_months = manifest["archive_months"]
+                self.listings = manifest["listings"]
+
+    def is_archive_missing(self, pair: str, year: int, month: int) -> bool:
+        index = month_index(year, month)
+        missing = self.missing_archives.get(pair, ())
+        if index in missing:
+            return True
+        months = self.archive_months.get(pair)
+        if months is not None:
+            if index < months[0] and any(index < m < months[0] for m in missing):
+                return True
+            if index > months[1] and any(months[1] < m < index for m in missing):
+                return True
+        monthStart = epoch_minute(datetime(year, month, 1))
+        return not self.is_listed(pair, monthStart, monthStart + minutes_in_month(year, month) - 1)
+
+    def is_listed(self, pair: str, firstMinute: int, lastMinute: int = None) -> bool:
+        '''False if the minutes from firstMinute to lastMinute are known to be outside the listing period of pair'''
+        first, last = self.listings.get(pair, (None, None))
+        lastMinute = firstMinute if lastMinute is None else lastMinute
+        return (first is None or lastMinute >= first) and (last is None or firstMinute <= last)
+
+    def add_missing_archive(self, pair: str, year: int, month: int) -> None:
+        nextMonth = datetime(year + month // 12, month % 12 + 1, 1)
+        if nextMonth + ARCHIVE_PUBLISH_DELAY > datetime.now():
+            return
+        with self.lock:
+            self.missing_archives.setdefault(pair, set()).add(month_index(year, month))
+            self.dirty = True
+
+    def add_archive(self, pair: str, year: int, month: int) -> None:
+        index = month_index(year, month)
+        with self.lock:
+            months = self.archive_months.get(pair)
+            if months is not None and months[0] <= index <= months[1]:
+                return
+            self.archive_months[pair] = [index, index] if months is None else [min(months[0], index), max(months[1], index)]
+            self.dirty = True
+
+    def set_listing(self, pair: str, firstMinute: int, lastMinute: int) -> None:
+        with self.lock:
+            self.listings[pair] = [firstMinute, lastMinute]
+            self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            with open(self.file + ".tmp", "w") as f:
+                json.dump({
+                    "version": MANIFEST_VERSION,
+                    "missing_archives": {pair: sorted(months) for pair, months in self.missing_archives.items()},
+                    "archive_months": self.archive_months,
+                    "listings": self.listings,
+                }, f)
+            os.replace(self.file + ".tmp", self.file)
+            self.dirty = False
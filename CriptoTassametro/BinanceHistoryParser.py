@@ -1,14 +1,23 @@
 import os.path
 import json
+import csv
 from binance.spot import Spot
 from dataclasses import dataclass
 from enum import Enum
 from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator
+import numpy as np
+import pandas as pd
 from .Components import *
-from .PriceProvider import PriceProvider
+from .PriceSource import PriceSource
+from .MemoizedPriceSource import MemoizedPriceSource
 from .OperationsDatabase import OperationsDatabase
 
 PRICE_ERROR_LIMIT = 0.5
+UNMATCHED_COST = 1e3  # cost of an impossible match in the assignment, small enough to keep the precision of the real errors
+FEE_RATIO = 0.001  # trading fee, of the bought amount
+BNB_FEE_RATIO = 0.00075  # trading fee when paid in BNB
+AMOUNT_PRECISION = 1e-8  # amounts in the history have 8 decimals
 
 
 class HistoryEntryType(Enum):
@@ -70,29 +79,106 @@ class HistoryEntryType(Enum):
 
 
 class HistoryEntry:
+    ''' A row of the binance history csv '''
+    __slots__ = ("user_id", "utc_time", "account", "operation", "coin", "change", "remark")
     TransactionTypeValues = set([member.value for member in HistoryEntryType])
+    TransactionTypes = {member.value: member for member in HistoryEntryType}
 
     def __init__(self, line: str) -> None:
-        parts = line.split(",")
-        self.user_id = parts[0][1:-1]
-        # parse datetime from format 2022-01-01 00:00:31
-        self.utc_time = datetime.strptime(parts[1][1:-1], "%Y-%m-%d %H:%M:%S")
-        self.utc_time = self.utc_time.replace(tzinfo=timezone.utc)
-        self.account = parts[2][1:-1]
-        if parts[3][1:-1] not in HistoryEntry.TransactionTypeValues:
-            raise ValueError(f"Unknown transaction type: {parts[3][1:-1]}")
-            self.operation = parts[3][1:-1]
-        else:
-            self.operation = HistoryEntryType(parts[3][1:-1])
-        self.coin = parts[4][1:-1]
-        self.change = float(parts[5][1:-1])
-        self.remark = parts[6][1:-1]
-        pass
+        HistoryEntryDecoder().decode_into(self, next(csv.reader([line])))
+
+    @staticmethod
+    def from_fields(user_id: str, utc_time: datetime, account: str, operation: HistoryEntryType,
+                    coin: str, change: float, remark: str) -> "HistoryEntry":
+        entry = HistoryEntry.__new__(HistoryEntry)
+        entry.user_id = user_id
+        entry.utc_time = utc_time
+        entry.account = account
+        entry.operation = operation
+        entry.coin = coin
+        entry.change = change
+        entry.remark = remark
+        return entry
 
     def __repr__(self) -> str:
         return f"{self.operation} {self.coin} {self.change}"
 
 
+class HistoryEntryDecoder:
+    ''' Decodes the rows of the binance history csv ( as split by csv.reader, so quoted commas are handled ).
+        The fills of an order share the same time, so the last time parsed is kept and reused. '''
+
+    def __init__(self) -> None:
+        self.last_time_text: str = None
+        self.last_time: datetime = None
+
+    def decode(self, row: list[str]) -> HistoryEntry:
+        return self.decode_into(HistoryEntry.__new__(HistoryEntry), row)
+
+    def decode_into(self, entry: HistoryEntry, row: list[str]) -> HistoryEntry:
+        entry.user_id, timeText, entry.account, operation, entry.coin, change, entry.remark = row
+        if timeText != self.last_time_text:
+            # parse datetime from format 2022-01-01 00:00:31
+            self.last_time = datetime.fromisoformat(timeText).replace(tzinfo=timezone.utc)
+            self.last_time_text = timeText
+        entry.utc_time = self.last_time
+        entry.operation = HistoryEntry.TransactionTypes.get(operation)
+        if entry.operation is None:
+            raise ValueError(f"Unknown transaction type: {operation}")
+        entry.change = float(change)
+        return entry
+
+
+class HistoryColumns:
+    ''' The rows of binance history csv files loaded at once as typed columns: epoch seconds,
+        operation code ( index in operation_types ), coin id ( index in coins ) and change.
+        User ids, accounts and remarks are kept as object arrays, only the rows that need the per-entry
+        path of BinanceHistoryParser are converted to HistoryEntry. '''
+    operation_types = list(HistoryEntryType)
+
+    def __init__(self, row: np.ndarray, time: np.ndarray, operation: np.ndarray, coin: np.ndarray, change: np.ndarray,
+                 user_id: np.ndarray, account: np.ndarray, remark: np.ndarray, coins: list[str]) -> None:
+        self.row = row  # index of the row in the files, as counted by BinanceHistoryParser.current_entry
+        self.time = time
+        self.operation = operation
+        self.coin = coin
+        self.change = change
+        self.user_id = user_id
+        self.account = account
+        self.remark = remark
+        self.coins = coins
+
+    def __len__(self) -> int:
+        return len(self.row)
+
+    @staticmethod
+    def codes(types: list[HistoryEntryType]) -> np.ndarray:
+        return np.array([HistoryColumns.operation_types.index(t) for t in types], dtype=np.int16)
+
+    @staticmethod
+    def load(files: list[str]) -> "HistoryColumns":
+        df = pd.concat([pd.read_csv(file, header=0, dtype=str, keep_default_na=False, encoding="utf8",
+                                    names=["user_id", "time", "account", "operation", "coin", "change", "remark"])
+                        for file in files], ignore_index=True)
+        operation = pd.Categorical(df["operation"], categories=[t.value for t in HistoryColumns.operation_types]).codes
+        if (operation < 0).any():
+            raise ValueError(f"Unknown transaction type: {df['operation'][operation < 0].iloc[0]}")
+        coin, coins = pd.factorize(df["coin"])
+        time = pd.to_datetime(df["time"], format="%Y-%m-%d %H:%M:%S").to_numpy(dtype="datetime64[s]").astype(np.int64)
+        return HistoryColumns(np.arange(len(df), dtype=np.int64), time, operation.astype(np.int16),
+                              coin.astype(np.int32), df["change"].to_numpy(dtype=np.float64),
+                              df["user_id"].to_numpy(), df["account"].to_numpy(), df["remark"].to_numpy(), list(coins))
+
+    def select(self, mask: np.ndarray) -> "HistoryColumns":
+        return HistoryColumns(self.row[mask], self.time[mask], self.operation[mask], self.coin[mask], self.change[mask],
+                              self.user_id[mask], self.account[mask], self.remark[mask], self.coins)
+
+    def entry(self, i: int) -> HistoryEntry:
+        return HistoryEntry.from_fields(self.user_id[i], datetime.fromtimestamp(int(self.time[i]), timezone.utc),
+                                        self.account[i], HistoryColumns.operation_types[self.operation[i]],
+                                        self.coins[self.coin[i]], float(self.change[i]), self.remark[i])
+
+
 class ExchangeEntryCombination:
     def __init__(self, buy: HistoryEntry, sell: HistoryEntry, fee: HistoryEntry = None, error=None) -> None:
         self.buy = buy
@@ -109,7 +195,7 @@ class ExchangeEntryCombination:
         buy_and_sell_different = self.buy.coin != self.sell.coin
         return buy_and_sell and user_id_ok and buy_and_sell_different
 
-    def error(self, priceProvider: PriceProvider) -> float:
+    def error(self, priceProvider: PriceSource) -> float:
         if self._error is not None:
             return self._error
 
@@ -129,7 +215,7 @@ class ExchangeEntryCombination:
             return self._error
 
         if self.fee is not None and self.fee.change != 0:
-            fee_ratio_expected = 0.00075 if self.fee.coin == "BNB" else 0.001
+            fee_ratio_expected = BNB_FEE_RATIO if self.fee.coin == "BNB" else FEE_RATIO
             fee_expected = self.buy.change * fee_ratio_expected
             fee_expected_converted = priceProvider.convert(
                 AssetAmount(self.buy.coin, fee_expected), self.fee.coin, self.fee.utc_time)
@@ -196,6 +282,102 @@ def generate_buy_sell_combinations(n):
             yield (i, j)
 
 
+def proportional(amounts: list[float], baseAmounts: list[float]) -> bool:
+    """ True if amounts[i] / baseAmounts[i] is the same for all i, up to the rounding of the amounts"""
+    if len(amounts) == 0 or baseAmounts[-1] == 0:
+        return False
+    ratio = amounts[-1] / baseAmounts[-1]
+    return all(abs(amount - ratio * base) <= 2 * AMOUNT_PRECISION * (1 + ratio) + amount * 1e-6
+               for amount, base in zip(amounts, baseAmounts))
+
+
+def match_fills_by_amounts(buys: list[HistoryEntry], sells: list[HistoryEntry],
+                           fees: list[HistoryEntry]) -> list[tuple[HistoryEntry, HistoryEntry, HistoryEntry]]:
+    """ matches the buys, sells and fees of the fills of an order without market prices, using the invariants of binance fills:
+        - all the fills have the same price, so ordering buys and sells by amount pairs them
+        - a fee in the bought asset is 0.1% ( 0.075% for BNB ) of the bought amount
+        - fees in BNB are all the same fraction of their bought amount, so ordering them by amount pairs them with the buys
+        Returns the (buy, sell, fee) of each fill, None when the amounts do not tell the matching"""
+    if len(set(buy.coin for buy in buys)) != 1 or len(set(sell.coin for sell in sells)) != 1 or buys[0].coin == sells[0].coin:
+        return None
+    buys = sorted(buys, key=lambda entry: abs(entry.change))
+    sells = sorted(sells, key=lambda entry: abs(entry.change))
+    if not proportional([abs(sell.change) for sell in sells], [abs(buy.change) for buy in buys]):
+        return None
+
+    coin = buys[0].coin
+    feeOf: dict[int, HistoryEntry] = {}
+    pending = []
+    noFees = [fee for fee in fees if fee.change == 0]
+    for fee in fees:
+        if fee.change == 0:
+            continue
+        candidates = [i for i, buy in enumerate(buys) if i not in feeOf and fee.coin == coin and
+                      any(abs(abs(fee.change) - ratio * abs(buy.change)) <= AMOUNT_PRECISION for ratio in (FEE_RATIO, BNB_FEE_RATIO))]
+        if len(set(abs(buys[i].change) for i in candidates)) > 1:
+            return None  # buys too close to tell which one paid this fee
+        if len(candidates) > 0:
+            feeOf[candidates[0]] = fee
+        else:
+            pending.append(fee)
+    if len(pending) > 0:
+        others = [i for i in range(len(buys)) if i not in feeOf]
+        pending.sort(key=lambda entry: abs(entry.change))
+        if any(fee.coin != "BNB" for fee in pending) or len(pending) != len(others) or \
+                not proportional([abs(fee.change) for fee in pending], [abs(buys[i].change) for i in others]):
+            return None
+        feeOf.update(zip(others, pending))
+    return [(buy, sell, feeOf[i] if i in feeOf else noFees.pop()) for i, (buy, sell) in enumerate(zip(buys, sells))]
+
+
+def min_cost_assignment(costs: list[list[float]]) -> list[int]:
+    """ hungarian algorithm, O(n^3): for a square matrix of costs returns the column assigned to each row
+        so that the total cost is the minimum"""
+    n = len(costs)
+    u = [0.0] * (n + 1)  # potentials of rows and columns, index 0 is a fake column
+    v = [0.0] * (n + 1)
+    rowOf = [0] * (n + 1)  # row ( 1 based ) assigned to each column, 0 if free
+    way = [0] * (n + 1)
+    for row in range(1, n + 1):
+        rowOf[0] = row
+        column = 0
+        minv = [float("inf")] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            # extend the alternating path with the cheapest reachable column
+            used[column] = True
+            i = rowOf[column]
+            delta = float("inf")
+            nextColumn = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    cur = costs[i - 1][j - 1] - u[i] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = column
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        nextColumn = j
+            for j in range(n + 1):
+                if used[j]:
+                    u[rowOf[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            column = nextColumn
+            if rowOf[column] == 0:
+                break
+        # flip the assignments along the path
+        while column != 0:
+            previous = way[column]
+            rowOf[column] = rowOf[previous]
+            column = previous
+    assigned = [0] * n
+    for j in range(1, n + 1):
+        assigned[rowOf[j] - 1] = j - 1
+    return assigned
+
+
 class BinanceHistoryParser:
     exchange_sell_types = [HistoryEntryType.Sell,
                            HistoryEntryType.Transaction_Sold,
@@ -238,48 +420,124 @@ class BinanceHistoryParser:
         exchange_sell_types + exchange_fee_types
     combinations_cache = {}
 
-    def __init__(self, price_provider: PriceProvider, operationsDb: OperationsDatabase) -> None:
+    def __init__(self, price_provider: PriceSource, operationsDb: OperationsDatabase) -> None:
         self.price_provider = price_provider
         self.new_operations: list[Operation] = []
         self.current_entry = -1
         self.operations_db = operationsDb
 
-    def parse_operations(self, hist_entries: list[HistoryEntry], fileName: str) -> list[Operation]:
+    def parse_operations(self, hist_entries: Iterable[HistoryEntry], fileName: str) -> list[Operation]:
         self.buffer: list[HistoryEntry] = []
-        self.entries: list[HistoryEntry] = list(hist_entries)
-        self.entries.reverse()
+        self.set_entries(hist_entries)
         self.completed = False
         self.history_file = fileName
-        while len(self.entries) > 0 or len(self.buffer) > 0:
-            date = self.entries[-1].utc_time.strftime("%Y-%m-%d %H:%M:%S")
-            try:
-                self.load_buffer()
-                self.process_exchange_operations()
-                self.process_small_assets_exchange_operations()
-                self.process_simple_operations()
-                if len(self.buffer) > 0:
-                    raise ValueError(f"Buffer not empty at {self.buffer[-1].utc_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-                print(f"Processed {self.current_entry} ({date})  of {fileName}")
-                # add operations to db
-                if len(self.new_operations) > 30:
-                    self.operations_db.add_operations(self.new_operations)
-                    self.operations_db.set_parsed(fileName, self.current_entry)
-                    self.operations_db.save()
-                    self.new_operations.clear()
-            except Exception as e:
-                print(f"Exception processing at {date}: {e}")
-                raise e
+        while self.next_entry is not None or len(self.buffer) > 0:
+            self.parse_next_group()
+        # add the last operations to db
+        self.save_operations()
+        print(f"Finished processing {self.current_entry} entries from {fileName}")
+
+    def parse_columns(self, columns: HistoryColumns, fileName: str) -> None:
+        """ same as parse_operations for a history loaded as columns. The groups of entries with the same time made of
+            a single buy, sell and fee ( or of fees only ) are found and matched with array operations,
+            only the other groups go through the per-entry path"""
+        self.buffer = []
+        self.history_file = fileName
+        codes = HistoryColumns.codes
+        allColumns = columns
+        columns = columns.select(~np.isin(columns.operation, codes(BinanceHistoryParser.ignore_types)) &
+                                 (columns.row > self.operations_db.get_last_line_parsed(fileName)))
+        n = len(columns)
+        if n == 0:
+            return
+        # groups are runs of entries with the same time, a run starting with a convert entry less than 1.5s after
+        # the previous one is merged with it ( see load_buffer )
+        runStarts = np.flatnonzero(np.concatenate(([True], columns.time[1:] != columns.time[:-1])))
+        converts = np.isin(columns.operation[runStarts], codes([HistoryEntryType.Binance_Convert,
+                                                                HistoryEntryType.Small_Assets_Exchange_BNB]))
+        merged = converts & (np.abs(np.diff(columns.time[runStarts], prepend=columns.time[0] - 2)) <= 1)
+        starts = runStarts[~merged]
+        ends = np.append(starts[1:], n)
+
+        def count(types: list[HistoryEntryType]) -> tuple[np.ndarray, np.ndarray]:
+            # number of entries of types in each group and the index of the last one
+            mask = np.isin(columns.operation, codes(types))
+            return np.add.reduceat(mask.astype(np.int64), starts), np.maximum.reduceat(np.where(mask, np.arange(n), -1), starts)
+        buys, buy = count(BinanceHistoryParser.exchange_buy_types)
+        sells, sell = count(BinanceHistoryParser.exchange_sell_types)
+        fees, fee = count(BinanceHistoryParser.exchange_fee_types)
+        sizes = ends - starts
+        single = (buys == 1) & (sells == 1) & (fees <= 1) & (sizes == 2 + fees)
+        onlyFees = fees == sizes
+
+        coins, change = columns.coins, columns.change
+        for g in range(len(starts)):
+            start, end = starts[g], ends[g]
+            if single[g]:
+                b, s, f = buy[g], sell[g], fee[g]
+                self.emit_operation(ExchangeOperation(
+                    AssetAmount(coins[columns.coin[s]], abs(float(change[s]))),
+                    AssetAmount(coins[columns.coin[b]], abs(float(change[b]))),
+                    AssetAmount(coins[columns.coin[f]], abs(float(change[f]))) if f >= 0 else AssetAmount("BNB", 0.0),
+                    datetime.fromtimestamp(int(columns.time[b]), timezone.utc)))
+            elif onlyFees[g]:
+                for i in range(start, end):
+                    self.emit_operation(FeePayment(coins[columns.coin[i]], float(change[i]),
+                                                   datetime.fromtimestamp(int(columns.time[i]), timezone.utc)))
+            else:
+                # ambiguous group, per-entry path on all the rows of the group ( ignored ones included )
+                self.set_entries(allColumns.entry(i) for i in range(columns.row[start], columns.row[end - 1] + 1))
+                self.current_entry = int(columns.row[start]) - 1
+                while self.next_entry is not None or len(self.buffer) > 0:
+                    self.parse_next_group()
+            self.current_entry = int(columns.row[end - 1])
+            if len(self.new_operations) > 30:
+                self.save_operations()
+        self.save_operations()
         print(f"Finished processing {self.current_entry} entries from {fileName}")
 
+    def set_entries(self, hist_entries: Iterable[HistoryEntry]) -> None:
+        # entries are consumed one by one ( hist_entries can be the generator of parse_files ),
+        # next_entry is the lookahead needed to group the entries with the same time
+        self.entries: Iterator[HistoryEntry] = iter(hist_entries)
+        self.next_entry: HistoryEntry = next(self.entries, None)
+
+    def parse_next_group(self) -> None:
+        date = self.next_entry.utc_time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            self.load_buffer()
+            self.process_exchange_operations()
+            self.process_small_assets_exchange_operations()
+            self.process_simple_operations()
+            if len(self.buffer) > 0:
+                raise ValueError(f"Buffer not empty at {self.buffer[-1].utc_time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+            print(f"Processed {self.current_entry} ({date})  of {self.history_file}")
+            # add operations to db
+            if len(self.new_operations) > 30:
+                self.save_operations()
+        except Exception as e:
+            print(f"Exception processing at {date}: {e}")
+            raise e
+
+    def save_operations(self) -> None:
+        if len(self.new_operations) == 0:
+            return
+        self.operations_db.add_operations(self.new_operations)
+        self.operations_db.set_parsed(self.history_file, self.current_entry)
+        self.operations_db.save()
+        self.new_operations.clear()
+
     def load_buffer(self):
-        if len(self.entries) < 1:
+        if self.next_entry is None:
             return
         entry = self.pop_entry()
         if entry is None:
             return
         while entry is not None and entry.operation in BinanceHistoryParser.ignore_types:
             entry = self.pop_entry()
+        if entry is None:
+            return
 
         self.buffer.append(entry)
         must_load_more_with_same_time = \
@@ -289,25 +547,30 @@ class BinanceHistoryParser:
         if must_load_more_with_same_time:
             # loads in the buffer all the entries that should be processed together
             def more():
-                if len(self.entries) < 1:
+                if self.next_entry is None:
                     return False
-                same_time = self.entries[-1].utc_time == entry.utc_time
+                same_time = self.next_entry.utc_time == entry.utc_time
                 time_diff_small = abs(
-                    entry.utc_time - self.entries[-1].utc_time) < timedelta(seconds=1.5)
-                same_group = self.entries[-1].operation == HistoryEntryType.Binance_Convert or \
-                    self.entries[-1].operation == HistoryEntryType.Small_Assets_Exchange_BNB
+                    entry.utc_time - self.next_entry.utc_time) < timedelta(seconds=1.5)
+                same_group = self.next_entry.operation == HistoryEntryType.Binance_Convert or \
+                    self.next_entry.operation == HistoryEntryType.Small_Assets_Exchange_BNB
                 return (same_time or (time_diff_small and same_group))
 
             while more():
                 self.buffer.append(self.pop_entry())
 
+    def advance_entry(self) -> HistoryEntry:
+        entry = self.next_entry
+        self.next_entry = next(self.entries, None)
+        return entry
+
     def pop_entry(self):
-        if (len(self.entries) < 1):
+        if self.next_entry is None:
             return None
-        entry = self.entries.pop()
+        entry = self.advance_entry()
         self.current_entry += 1
-        while self.operations_db.check_parsed(self.history_file, self.current_entry) and len(self.entries) > 0:
-            entry = self.entries.pop()
+        while self.operations_db.check_parsed(self.history_file, self.current_entry) and self.next_entry is not None:
+            entry = self.advance_entry()
             self.current_entry += 1
 
         return entry if not self.operations_db.check_parsed(self.history_file, self.current_entry) else None
@@ -325,9 +588,7 @@ class BinanceHistoryParser:
 
         # fill fees with zero entries if there are not enough
         while len(fees) < len(buys):
-            tstr = buys[0].utc_time.strftime("%Y-%m-%d %H:%M:%S")
-            dummyFee = HistoryEntry(f"'0','{tstr}',ignore,'Fee','BNB','0',ignore")
-            dummyFee.user_id = None
+            dummyFee = HistoryEntry.from_fields(None, buys[0].utc_time, "ignore", HistoryEntryType.Fee, "BNB", 0.0, "ignore")
             fees.append(dummyFee)
 
         # if there are only fees then emit them as operations
@@ -350,31 +611,25 @@ class BinanceHistoryParser:
                 self.buffer.remove(fees[0])
             return
 
-        # produce all possible combinations of (buys, sells, fees)
-        combinations: list[ExchangeEntryCombination] = []
-        n = len(buys)
-        for comb_indexes in generate_buy_sell_fee_combinations(n):
-            buy = buys[comb_indexes[0]]
-            sell = sells[comb_indexes[1]]
-            fee = fees[comb_indexes[2]]
-            comb = ExchangeEntryCombination(buy, sell, fee)
-            combinations.append(comb)
-        combinations.sort(key=lambda comb: comb.error(self.price_provider))
-
-        # pick the best n compatibles combinations
-        # they are compatible if they do not share the same buy, sell or fee
-        chosen: list[ExchangeEntryCombination] = []
-        buysTaken = []
-        sellsTaken = []
-        feesTaken = []
-        for comb in combinations:
-            if not (comb.buy in buysTaken or comb.sell in sellsTaken or comb.fee in feesTaken):
-                chosen.append(comb)
-                buysTaken.append(comb.buy)
-                sellsTaken.append(comb.sell)
-                feesTaken.append(comb.fee)
-                if len(chosen) == n:
-                    break
+        matches = match_fills_by_amounts(buys, sells, fees)
+        if matches is not None:
+            # the amounts tell which entries belong together, no market price needed
+            chosen = [ExchangeEntryCombination(buy, sell, fee, 0) for buy, sell, fee in matches]
+        else:
+            # match buys with sells minimizing the total price error, then the pairs with the fees minimizing
+            # the total error. Prices are memoized so that each asset pair is looked up once
+            prices = MemoizedPriceSource(self.price_provider)
+            n = len(buys)
+            sellOf = min_cost_assignment([
+                [min(ExchangeEntryCombination(buy, sell).error(prices), UNMATCHED_COST) for sell in sells] for buy in buys])
+            feeOf = min_cost_assignment([
+                [min(ExchangeEntryCombination(buys[i], sells[sellOf[i]], fee).error(prices), UNMATCHED_COST) for fee in fees]
+                for i in range(n)])
+            chosen = [ExchangeEntryCombination(buys[i], sells[sellOf[i]], fees[feeOf[i]]) for i in range(n)]
+            chosen.sort(key=lambda comb: comb.error(prices))
+        buysTaken = buys
+        sellsTaken = sells
+        feesTaken = [comb.fee for comb in chosen]
         # create operations from chosen combinations
         for comb in chosen:
             self.emit_operation(comb.to_operation())
@@ -493,19 +748,20 @@ class BinanceHistoryParser:
         pass
 
 
-def parse_files(files: list[str], max_lines=None) -> list[HistoryEntry]:
-    movements: list[HistoryEntry] = []
+def parse_files(files: list[str], max_lines=None) -> Iterator[HistoryEntry]:
+    """yields the entries of the files one at a time, so that memory does not grow with the size of the files"""
+    count = 0
+    decoder = HistoryEntryDecoder()
     for file_path in files:
-        with open(file_path, encoding="utf8") as fileStream:
-            fileStream.readline()  # skip header
-            for li in fileStream.readlines():
-                li = li.strip("\n")
-                if li != "":
-                    mov = HistoryEntry(li)
-                    movements.append(mov)
-                    if max_lines is not None and len(movements) >= max_lines:
-                        return movements
-    return movements
+        with open(file_path, encoding="utf8", newline="") as fileStream:
+            rows = csv.reader(fileStream)
+            next(rows, None)  # skip header
+            for row in rows:
+                if len(row) > 0:
+                    yield decoder.decode(row)
+                    count += 1
+                    if max_lines is not None and count >= max_lines:
+                        return
 
 
 class Wallet:
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from typing import Callable
+
+
+class LruCache:
+    ''' A bounded dictionary, when full the least recently used entries are dropped.
+        By default every entry has size 1 so maxSize is the number of entries, a sizeOf function
+        can be given to bound the cache by another measure ( i.e. bytes ).
+        Values can be None, so lookups return a (found, value) tuple. '''
+
+    def __init__(self, maxSize: int, sizeOf: Callable[[object], int] = None):
+        self.max_size = maxSize
+        self.size_of = sizeOf if sizeOf is not None else (lambda value: 1)
+        self.items = OrderedDict()
+        self.sizes = {}
+        self.resident_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def lookup(self, key) -> tuple[bool, object]:
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return (True, self.items[key])
+        self.misses += 1
+        return (False, None)
+
+    def put(self, key, value) -> None:
+        if self.max_size <= 0:
+            return
+        if key in self.items:
+            self.resident_size -= self.sizes[key]
+        self.items[key] = value
+        self.items.move_to_end(key)
+        self.sizes[key] = self.size_of(value)
+        self.resident_size += self.sizes[key]
+        # the last inserted entry is always kept, even if bigger than max_size
+        while self.resident_size > self.max_size and len(self.items) > 1:
+            evicted, _ = self.items.popitem(last=False)
+            self.resident_size -= self.sizes.pop(evicted)
+            self.evictions += 1
+
+    def remove_if(self, predicate: Callable[[object], bool]) -> None:
+        '''remove the entries whose value satisfies predicate'''
+        for key in [key for key, value in self.items.items() if predicate(value)]:
+            del self.items[key]
+            self.resident_size -= self.sizes.pop(key)
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.sizes.clear()
+        self.resident_size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.items),
+            "resident_size": self.resident_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -12,19 +12,68 @@ class AssetAmount:
         return f"{self.amount} {self.symbol}"
 
 
+# interned assets, the id of an asset is its index in asset_names
+asset_ids: dict[str, int] = {}
+asset_names: list[str] = []
+
+
+def asset_id(asset: str) -> int:
+    assetId = asset_ids.get(asset)
+    if assetId is None:
+        assetId = asset_ids[asset] = len(asset_names)
+        asset_names.append(asset)
+    return assetId
+
+
 class Symbol:
-    def __init__(self, baseAsset: str, quoteAsset: str):
-        self.baseAsset = baseAsset
-        self.quoteAsset = quoteAsset
-        self.key = f"{baseAsset}{quoteAsset}"
+    ''' A market, the price of baseAsset in quoteAsset.
+        Symbols are interned: Symbol(baseAsset, quoteAsset) always returns the same immutable object,
+        with small integer ids for itself and for its assets, so that caches can key on ints. '''
+    __slots__ = ("baseAsset", "quoteAsset", "key", "id", "base_id", "quote_id", "_reverse")
+    registry: dict[tuple[str, str], "Symbol"] = {}
+
+    def __new__(cls, baseAsset: str, quoteAsset: str):
+        symbol = Symbol.registry.get((baseAsset, quoteAsset))
+        if symbol is None:
+            symbol = super().__new__(cls)
+            assign = object.__setattr__  # the attributes are set only here, see __setattr__
+            assign(symbol, "baseAsset", baseAsset)
+            assign(symbol, "quoteAsset", quoteAsset)
+            assign(symbol, "key", f"{baseAsset}{quoteAsset}")
+            assign(symbol, "id", len(Symbol.registry))
+            assign(symbol, "base_id", asset_id(baseAsset))
+            assign(symbol, "quote_id", asset_id(quoteAsset))
+            assign(symbol, "_reverse", None)
+            Symbol.registry[(baseAsset, quoteAsset)] = symbol
+        return symbol
+
+    def __setattr__(self, name: str, value) -> None:
+        # a symbol is shared by everyone asking for the same market and caches are keyed on its ids
+        raise AttributeError(f"Symbol is immutable, {name} can not be set")
 
     def reverse(self):
-        return Symbol(self.quoteAsset, self.baseAsset)
+        if self._reverse is None:
+            object.__setattr__(self, "_reverse", Symbol(self.quoteAsset, self.baseAsset))
+        return self._reverse
 
     def __str__(self) -> str:
         return self.key
 
 
+class Granularity(Enum):
+    ''' Resolution of the prices, the value is the number of minutes of a period.
+        At minute granularity the price at time is the close of the minute of time,
+        at hour and day granularity it is the close of the last hour ( day ) completed at time. '''
+    Minute = 1
+    Hour = 60
+    Day = 1440
+
+    @property
+    def interval(self) -> str:
+        '''name of the kline interval on binance'''
+        return {1: "1m", 60: "1h", 1440: "1d"}[self.value]
+
+
 class Operation:
     def __init__(self, time: datetime):
         self.time = time
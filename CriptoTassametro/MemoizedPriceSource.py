@@ -0,0 +1,31 @@
+from datetime import datetime
+from .Components import Symbol, AssetAmount, Granularity
+from .PriceSource import PriceSource
+
+
+class MemoizedPriceSource(PriceSource):
+    ''' Wraps a PriceSource remembering every price and conversion rate asked, so that scoring many
+        combinations of the same entries costs one lookup per asset pair.
+        Conversions are linear in the amount, so the rate of one unit is kept. '''
+
+    def __init__(self, prices: PriceSource):
+        self.prices = prices
+        self.known_prices: dict[tuple[Symbol, datetime, Granularity], float] = {}
+        self.known_rates: dict[tuple[str, str, datetime, Granularity], float] = {}
+
+    def get_price(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
+        key = (symbol, time, granularity)
+        if key not in self.known_prices:
+            self.known_prices[key] = self.prices.get_price(symbol, time, granularity)
+        return self.known_prices[key]
+
+    def convert(self, asset: AssetAmount, destinationAsset: str, time: datetime,
+                granularity: Granularity = Granularity.Minute) -> AssetAmount:
+        if asset.symbol == destinationAsset:
+            return asset
+        key = (asset.symbol, destinationAsset, time, granularity)
+        if key not in self.known_rates:
+            converted = self.prices.convert(AssetAmount(asset.symbol, 1.0), destinationAsset, time, granularity)
+            self.known_rates[key] = None if converted is None or converted.amount is None else converted.amount
+        rate = self.known_rates[key]
+        return None if rate is None else AssetAmount(destinationAsset, asset.amount * rate)
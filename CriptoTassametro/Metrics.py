@@ -0,0 +1,105 @@
+import json
+import math
+from datetime import datetime
+
+
+class LatencyHistogram:
+    ''' Count and total time of a set of measures, with a histogram of the latencies
+        in power of 2 buckets of microseconds ( bucket i holds the measures up to 2**i us ). '''
+
+    buckets_count = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  # seconds
+        self.max = 0.0
+        self.buckets = [0] * LatencyHistogram.buckets_count
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        microseconds = seconds * 1e6
+        bucket = 0 if microseconds <= 1 else math.ceil(math.log2(microseconds))
+        self.buckets[min(bucket, LatencyHistogram.buckets_count - 1)] += 1
+
+    def percentile(self, p: float) -> float:
+        '''upper bound in seconds of the latency of the p ( 0 - 100 ) percentile'''
+        if self.count == 0:
+            return 0.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= self.count * p / 100:
+                return 2 ** bucket / 1e6
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count > 0 else 0.0,
+            "p50_seconds": self.percentile(50),
+            "p99_seconds": self.percentile(99),
+            "max_seconds": self.max,
+            "histogram_us": {str(2 ** bucket): count for bucket, count in enumerate(self.buckets) if count > 0},
+        }
+
+
+class PriceMetrics:
+    ''' Counters and latencies of the price lookups by tier ( memory, db, stores, rest, archive ... ),
+        also split by symbol and by month of the price to find which assets or months are costly.
+        Every tier has a "hit" and a "miss" outcome.
+        Lookups served by the memory cache are only counted, timing them would cost more than the lookup. '''
+
+    def __init__(self):
+        self.tiers: dict[tuple[str, str], LatencyHistogram] = {}  # (tier, outcome)
+        self.symbols: dict[tuple[str, str, str], LatencyHistogram] = {}  # (tier, outcome, symbol)
+        self.months: dict[tuple[str, str, str], int] = {}  # (tier, outcome, month) -> count
+        self.memory_hits = 0
+        self.memory_misses = 0
+
+    def record(self, tier: str, symbol: str, time: datetime, hit: bool, seconds: float) -> None:
+        outcome = "hit" if hit else "miss"
+        month = f"{time.year}-{time.month:02}"
+        self.tiers.setdefault((tier, outcome), LatencyHistogram()).add(seconds)
+        self.symbols.setdefault((tier, outcome, symbol), LatencyHistogram()).add(seconds)
+        self.months[(tier, outcome, month)] = self.months.get((tier, outcome, month), 0) + 1
+
+    def memory_stats(self) -> dict:
+        return {"hit": {"count": self.memory_hits}, "miss": {"count": self.memory_misses}}
+
+    def tier_stats(self, tier: str) -> dict:
+        '''{outcome: stats} of a tier, see LatencyHistogram.to_dict ( only the counts for the memory tier )'''
+        if tier == "memory":
+            return self.memory_stats()
+        return {outcome: histogram.to_dict() for (t, outcome), histogram in self.tiers.items() if t == tier}
+
+    def symbol_stats(self, symbol: str) -> dict:
+        '''{tier: {outcome: stats}} of a symbol'''
+        stats = {}
+        for (tier, outcome, s), histogram in self.symbols.items():
+            if s == symbol:
+                stats.setdefault(tier, {})[outcome] = histogram.to_dict()
+        return stats
+
+    def costliest_symbols(self, count: int = 10) -> list[tuple[str, float]]:
+        '''the symbols with the highest total time spent in the lookups, (symbol, seconds)'''
+        totals = {}
+        for (tier, outcome, symbol), histogram in self.symbols.items():
+            totals[symbol] = totals.get(symbol, 0.0) + histogram.total
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def to_dict(self) -> dict:
+        result = {"tiers": {"memory": self.memory_stats()}, "symbols": {}, "months": {}}
+        for (tier, outcome), histogram in sorted(self.tiers.items()):
+            result["tiers"].setdefault(tier, {})[outcome] = histogram.to_dict()
+        for (tier, outcome, symbol), histogram in sorted(self.symbols.items()):
+            result["symbols"].setdefault(symbol, {}).setdefault(tier, {})[outcome] = histogram.to_dict()
+        for (tier, outcome, month), count in sorted(self.months.items()):
+            result["months"].setdefault(month, {}).setdefault(tier, {})[outcome] = count
+        return result
+
+    def dump(self, file: str) -> None:
+        with open(file, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,153 @@
+import calendar
+import os
+import zipfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .Components import Granularity
+
+
+def epoch_minute(time: datetime) -> int:
+    '''minutes elapsed since 1970-01-01, naive datetimes are considered UTC'''
+    return calendar.timegm(time.utctimetuple()) // 60
+
+
+def month_index(year: int, month: int) -> int:
+    '''months elapsed since year 0'''
+    return year * 12 + month - 1
+
+
+def price_slot(time: datetime, granularity: Granularity) -> int:
+    '''index of the period ( minute, hour or day since 1970-01-01 ) whose close is the price at time, see Granularity'''
+    if granularity == Granularity.Minute:
+        return epoch_minute(time)
+    return epoch_minute(time) // granularity.value - 1
+
+
+def minutes_in_month(year: int, month: int) -> int:
+    return calendar.monthrange(year, month)[1] * 24 * 60
+
+
+class MinuteCloseStore:
+    ''' Close prices of a symbol for one month, saved as a fixed length array of float64 indexed
+        by minute of the month ( NaN where there is no kline ).
+        The file is opened as a memory map so that a lookup is just an array index and
+        processes working on the same files share the page cache.
+        Stores of hourly or daily closes, derived from the minute one, have a resolution of 60 or 1440 minutes. '''
+
+    def __init__(self, storeFile: str, year: int, month: int, resolution: int = 1):
+        self.file = storeFile
+        self.resolution = resolution
+        self.first_minute = epoch_minute(datetime(year, month, 1))
+        self.first_slot = self.first_minute // resolution
+        self.closes = np.memmap(storeFile, dtype=np.float64, mode="r")
+        self.minutes = None  # sorted index of the slots with a price, built on first as-of lookup
+
+    @property
+    def nbytes(self) -> int:
+        return self.closes.nbytes + (self.minutes.nbytes if self.minutes is not None else 0)
+
+    def get(self, time: datetime, maxStaleness: int = 0) -> float:
+        '''close price of the minute of time, if it is missing the last close up to maxStaleness minutes before'''
+        return self.get_slot(epoch_minute(time) // self.resolution, maxStaleness)
+
+    def get_slot(self, slot: int, maxStaleness: int = 0) -> float:
+        '''close price of the period slot ( see price_slot ), if it is missing the last close up to maxStaleness periods before'''
+        index = slot - self.first_slot
+        if index < 0:
+            return None
+        if index < len(self.closes) and not np.isnan(self.closes[index]):
+            return float(self.closes[index])
+        if maxStaleness <= 0:
+            return None
+        # as-of lookup: binary search of the last minute with a price
+        if self.minutes is None:
+            self.minutes = np.flatnonzero(~np.isnan(self.closes)).astype(np.int64)
+        position = np.searchsorted(self.minutes, index, side="right") - 1
+        if position < 0 or index - self.minutes[position] > maxStaleness:
+            return None
+        return float(self.closes[self.minutes[position]])
+
+    def get_many(self, minutes: np.ndarray, maxStaleness: int = 0) -> np.ndarray:
+        '''vectorized get, minutes is an array of epoch minutes, NaN where there is no price'''
+        indexes = minutes // self.resolution - self.first_slot
+        result = np.full(len(minutes), np.nan)
+        inMonth = (indexes >= 0) & (indexes < len(self.closes))
+        result[inMonth] = self.closes[indexes[inMonth]]
+        if maxStaleness > 0:
+            if self.minutes is None:
+                self.minutes = np.flatnonzero(~np.isnan(self.closes)).astype(np.int64)
+            missing = np.isnan(result) & (indexes >= 0)
+            positions = np.searchsorted(self.minutes, indexes[missing], side="right") - 1
+            found = positions >= 0
+            lastMinutes = self.minutes[np.maximum(positions, 0)]
+            found &= indexes[missing] - lastMinutes <= maxStaleness
+            result[np.flatnonzero(missing)[found]] = self.closes[lastMinutes[found]]
+        return result
+
+    @staticmethod
+    def derive(minuteStoreFile: str, storeFile: str, resolution: int) -> None:
+        '''create the store of the closes of the periods of resolution minutes ( hours or days ) of a minute store,
+           the close of a period is its last minute close. All the periods are computed at once'''
+        closes = np.fromfile(minuteStoreFile, dtype=np.float64).reshape(-1, resolution)
+        # index of the last minute with a price of each period, the last minute ( NaN ) when there is none
+        last = resolution - 1 - np.argmax(~np.isnan(closes[:, ::-1]), axis=1)
+        closes[np.arange(len(closes)), last].tofile(storeFile + ".tmp")
+        os.replace(storeFile + ".tmp", storeFile)
+
+    @staticmethod
+    def build_from_zip(zipFile: str, storeFile: str, year: int, month: int, resolution: int = 1) -> None:
+        '''create the store file streaming the kline csv out of a binance data archive, without extracting it'''
+        with zipfile.ZipFile(zipFile, "r") as archive:
+            with archive.open(archive.namelist()[0]) as csv:
+                MinuteCloseStore.build(csv, storeFile, year, month, resolution)
+
+    @staticmethod
+    def build(csv, storeFile: str, year: int, month: int, resolution: int = 1) -> None:
+        '''create the store file from a binance data kline csv ( file path or file object ),
+           only the timestamp and close columns are parsed. The klines of the csv must be of resolution minutes'''
+        df = pd.read_csv(
+            csv,
+            header=None,
+            engine="c",
+            usecols=[0, 4],
+            names=["timestamp", "close"],
+        )
+        # some archives start with a header line, it is dropped as it is not numeric
+        df = df.apply(pd.to_numeric, errors="coerce").dropna()
+        timestamps = df["timestamp"].to_numpy(dtype=np.int64)
+        # since 2025 binance data files have timestamps in microseconds
+        timestamps = np.where(timestamps > 10**14, timestamps // 1000, timestamps)
+        indexes = timestamps // 60000 // resolution - epoch_minute(datetime(year, month, 1)) // resolution
+        closes = np.full(minutes_in_month(year, month) // resolution, np.nan, dtype=np.float64)
+        inMonth = (indexes >= 0) & (indexes < len(closes))
+        closes[indexes[inMonth]] = df["close"].to_numpy()[inMonth]
+        # write to a temporary file first so that a partially written store is never opened
+        closes.tofile(storeFile + ".tmp")
+        os.replace(storeFile + ".tmp", storeFile)
+
+
+class MinuteCloseWindows:
+    ''' Close prices of a symbol downloaded from binance api, kept by minute together with
+        the ranges of minutes that were requested, so that it is known where a missing minute
+        means that there was no kline and where it means that it has not been downloaded. '''
+
+    def __init__(self):
+        self.ranges: list[tuple[int, int]] = []
+        self.closes: dict[int, float] = {}
+
+    def add(self, firstMinute: int, lastMinute: int, closes: dict[int, float]) -> None:
+        self.ranges.append((firstMinute, lastMinute))
+        self.closes.update(closes)
+
+    def covers(self, firstMinute: int, lastMinute: int) -> bool:
+        return any(first <= firstMinute and lastMinute <= last for first, last in self.ranges)
+
+    def get(self, minute: int, lookBack: int) -> tuple[bool, float]:
+        '''last close between minute - lookBack and minute, found is False if those minutes were not downloaded'''
+        if not self.covers(minute - lookBack, minute):
+            return (False, None)
+        for m in range(minute, minute - lookBack - 1, -1):
+            if m in self.closes:
+                return (True, self.closes[m])
+        return (True, None)
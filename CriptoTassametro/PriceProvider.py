@@ -1,219 +1,804 @@
-from sqlalchemy import String, Float, DateTime
+from sqlalchemy import String, Float, Integer
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from datetime import datetime, timedelta
-from sqlalchemy import create_engine, select
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from sqlalchemy import create_engine, select, insert
 from sqlalchemy.orm import Session
 from binance.spot import Spot
-from .Components import Symbol, AssetAmount
-import pandas as pd
-import requests
+from .Components import Symbol, AssetAmount, Granularity
+from .Caches import LruCache
+from .MinuteStore import MinuteCloseStore, MinuteCloseWindows, epoch_minute, month_index, price_slot
+from .RoutePlanner import RoutePlanner
+from .ArchiveDownloader import ArchiveDownloader, ARCHIVE_BASE_URL
+from .ArchiveManifest import ArchiveManifest
+from .PriceSource import PriceSource
+from .Metrics import PriceMetrics
 import zipfile
+import numpy as np
+import json
 import os
+import time as systime
+import atexit
  
 class Base(DeclarativeBase):
     pass
 
 
+class Asset(Base):
+    __tablename__ = "assets"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[String] = mapped_column(String, unique=True)
+
+
 class Price(Base):
-    __tablename__ = "prices"
-    asset: Mapped[String] = mapped_column(String, primary_key=True)
-    quoteAsset: Mapped[String] = mapped_column(String, primary_key=True)
-    time: Mapped[DateTime] = mapped_column(DateTime, primary_key=True)
+    __tablename__ = "minute_prices"
+    __table_args__ = {"sqlite_with_rowid": False}  # rows are clustered by primary key
+    asset: Mapped[int] = mapped_column(Integer, primary_key=True)  # Asset.id
+    quoteAsset: Mapped[int] = mapped_column(Integer, primary_key=True)  # Asset.id
+    minute: Mapped[int] = mapped_column(Integer, primary_key=True)  # minutes since 1970-01-01 UTC
     price: Mapped[Float] = mapped_column(Float, nullable=True)
 
 
-class PriceProvider:
+class HourPrice(Base):
+    __tablename__ = "hour_prices"
+    __table_args__ = {"sqlite_with_rowid": False}
+    asset: Mapped[int] = mapped_column(Integer, primary_key=True)
+    quoteAsset: Mapped[int] = mapped_column(Integer, primary_key=True)
+    hour: Mapped[int] = mapped_column(Integer, primary_key=True)  # hours since 1970-01-01 UTC
+    price: Mapped[Float] = mapped_column(Float, nullable=True)  # close of the hour
+
+
+class DayPrice(Base):
+    __tablename__ = "day_prices"
+    __table_args__ = {"sqlite_with_rowid": False}
+    asset: Mapped[int] = mapped_column(Integer, primary_key=True)
+    quoteAsset: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[int] = mapped_column(Integer, primary_key=True)  # days since 1970-01-01 UTC
+    price: Mapped[Float] = mapped_column(Float, nullable=True)  # close of the day
+
+
+# table and period column of the prices of each granularity
+PRICE_TABLES = {
+    Granularity.Minute: (Price, "minute"),
+    Granularity.Hour: (HourPrice, "hour"),
+    Granularity.Day: (DayPrice, "day"),
+}
+
+PRICES_SCHEMA_VERSION = 3
+
+
+# upsert clause of the copies of prices between dbs: a missing price ( NULL ) is replaced by an actual one
+_KEEP_PRICE_ON_CONFLICT = ("ON CONFLICT (asset, quoteAsset, {column}) DO UPDATE SET price = excluded.price "
+                           "WHERE {table}.price IS NULL AND excluded.price IS NOT NULL")
+
+
+def _copy_legacy_prices(connection, schema: str) -> int:
+    """ copy the prices of the old schema table {schema}.prices ( text assets and datetime keys ) to minute_prices.
+        Prices in the same minute are merged, an actual price has precedence over a missing one"""
+    connection.exec_driver_sql(
+        f"INSERT OR IGNORE INTO assets (name) "
+        f"SELECT asset FROM {schema}.prices UNION SELECT quoteAsset FROM {schema}.prices")
+    result = connection.exec_driver_sql(
+        f"INSERT INTO minute_prices (asset, quoteAsset, minute, price) "
+        f"SELECT a.id, q.id, CAST(strftime('%s', p.time) AS INTEGER) / 60, p.price FROM {schema}.prices p "
+        f"JOIN assets a ON a.name = p.asset JOIN assets q ON q.name = p.quoteAsset WHERE true "
+        f"ORDER BY p.price IS NULL {_KEEP_PRICE_ON_CONFLICT.format(table='minute_prices', column='minute')}")
+    return result.rowcount
+
+
+def _has_legacy_prices(connection, schema: str) -> bool:
+    return connection.exec_driver_sql(
+        f"SELECT count(*) FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'prices'").scalar() > 0
+
+
+def migrate_prices_db(dbFile: str) -> int:
+    """ convert a prices db created with the old schema to the current one ( a db already converted is left untouched ).
+        Returns the number of prices migrated"""
+    engine = create_engine(f"sqlite:///{dbFile}", echo=False)
+    Base.metadata.create_all(engine)
+    migrated = 0
+    with engine.connect() as connection:
+        if _has_legacy_prices(connection, "main"):
+            migrated = _copy_legacy_prices(connection, "main")
+            connection.exec_driver_sql("DROP TABLE prices")
+        connection.exec_driver_sql(f"PRAGMA user_version = {PRICES_SCHEMA_VERSION}")
+        connection.commit()
+        if migrated > 0:
+            connection.exec_driver_sql("VACUUM")
+    engine.dispose()
+    return migrated
+
+
+EXCHANGE_INFO_SNAPSHOT_VERSION = 1
+REST_LOOK_BACK = 60 * 6  # minutes, the api price is the last close in this period
+REST_KLINES_LIMIT = 1000  # max klines returned by a single api call
+SYMBOL_ID_BITS = 24  # int cache keys are made of a minute ( or a month ) and a Symbol.id in the lowest bits
+GRANULARITY_CODES = {Granularity.Minute: 0, Granularity.Hour: 1, Granularity.Day: 2}
+
+
+class PriceProvider(PriceSource):
     def __init__(self, dbFile: str, 
-                 filesCacheDir: str = os.path.join(os.getcwd(), "data", "cache")):
+                 filesCacheDir: str = os.path.join(os.getcwd(), "data", "cache"),
+                 cacheSize: int = 100000,
+                 offline: bool = False,  # never use the network, prices come only from the db and the files cache
+                 exchangeInfoMaxAge: timedelta = timedelta(days=1),  # refresh the active symbols snapshot when older than this
+                 flushSize: int = 1000,  # new prices are written to the db in batches of this size
+                 flushInterval: timedelta = timedelta(seconds=30),  # ... or when the oldest unwritten price is older than this ( checked on insert )
+                 archiveBaseUrl: str = ARCHIVE_BASE_URL,
+                 downloadWorkers: int = 8,
+                 storesMemoryBudget: int = 512 * 2**20,  # bytes
+                 maxStaleness: timedelta = timedelta(0)):  # when a minute is missing in the archives use the last price up to this old
+        migrated = migrate_prices_db(dbFile)
+        if migrated > 0:
+            print(f"Migrated {migrated} prices of {dbFile} to schema version {PRICES_SCHEMA_VERSION}")
         self.db = create_engine(f"sqlite:///{dbFile}", echo=False)
-        Base.metadata.create_all(self.db)
+        with Session(self.db) as session:
+            self.asset_ids: dict[str, int] = {asset.name: asset.id for asset in session.scalars(select(Asset))}
+        self.offline = offline
+        self.files_cache_dir = filesCacheDir
+        if not os.path.exists(self.files_cache_dir):
+            os.makedirs(self.files_cache_dir)
+        # missing archives and listing periods, so that lookups of prices that binance does not have end immediately
+        self.manifest = ArchiveManifest(self.get_cached_file("manifest.json"))
+        self.downloader = ArchiveDownloader(self.files_cache_dir, archiveBaseUrl, downloadWorkers, manifest=self.manifest)
         self.client = Spot()
-        exchangeInfo = self.client.exchange_info()
-        self.symbols_active = set(
+        self.symbols_active = self._load_symbols_active(exchangeInfoMaxAge)
+        self.symbols = set(self.symbols_active).union(known_symbols)
+        self.df = None
+        # open minute stores, the least recently used are closed when their size exceeds the memory budget
+        self.df_cache = LruCache(storesMemoryBudget, lambda store: store.nbytes)
+        self.max_staleness = int(maxStaleness.total_seconds() // 60)
+        # in memory cache of resolved prices ( misses included ), see _price_cache_key
+        self.price_cache = LruCache(cacheSize)
+        # klines downloaded from binance api by (Symbol.id, granularity)
+        self.rest_klines: dict[tuple[int, Granularity], MinuteCloseWindows] = {}
+        self.route_planner = RoutePlanner(self.has_market)
+        # counters and latencies of the lookups by tier, symbol and month
+        self.metrics = PriceMetrics()
+        # write-behind buffer of prices not yet written to the db, (symbol, granularity, period) -> price
+        self.pending_prices: dict[tuple[Symbol, Granularity, int], float] = {}
+        # Symbol.id -> the known pairs of the symbol in any direction, see has_market
+        self.markets: dict[int, list[str]] = {}
+        self.flush_size = flushSize
+        self.flush_interval = flushInterval.total_seconds()
+        self.first_pending = None  # monotonic time of the oldest unwritten price
+        # pending prices are written at interpreter exit, also after an unhandled exception,
+        # but not when the process is killed by a signal ( SIGKILL, or SIGTERM without a handler )
+        atexit.register(self.flush)
+
+    def __enter__(self) -> "PriceProvider":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """write pending prices to the db and release it"""
+        self.flush()
+        atexit.unregister(self.flush)
+        self.db.dispose()
+
+    def flush(self) -> None:
+        """write all the pending prices to the db with a single bulk insert.
+           Registered with atexit: prices are not lost on normal exits and unhandled exceptions, they are on SIGKILL / SIGTERM"""
+        if len(self.pending_prices) > 0:
+            with Session(self.db) as session:
+                newAssets = set(asset for symbol, granularity, slot in self.pending_prices
+                                for asset in (symbol.baseAsset, symbol.quoteAsset) if asset not in self.asset_ids)
+                if len(newAssets) > 0:
+                    session.execute(insert(Asset).prefix_with("OR IGNORE"), [dict(name=name) for name in newAssets])
+                    for asset in session.scalars(select(Asset).where(Asset.name.in_(newAssets))):
+                        self.asset_ids[asset.name] = asset.id
+                rows = {granularity: [] for granularity in PRICE_TABLES}
+                for (symbol, granularity, slot), price in self.pending_prices.items():
+                    rows[granularity].append({
+                        "asset": self.asset_ids[symbol.baseAsset],
+                        "quoteAsset": self.asset_ids[symbol.quoteAsset],
+                        PRICE_TABLES[granularity][1]: slot,
+                        "price": price})
+                for granularity, (table, column) in PRICE_TABLES.items():
+                    if len(rows[granularity]) > 0:
+                        session.execute(insert(table).prefix_with("OR IGNORE"), rows[granularity])
+                session.commit()
+            self.pending_prices.clear()
+        self.manifest.save()
+        self.first_pending = None
+
+    def _load_symbols_active(self, maxAge: timedelta) -> set[str]:
+        """ symbols currently traded on binance, taken from the local snapshot of exchange_info
+            if it is recent enough ( or if offline ) otherwise from binance api"""
+        snapshotFile = self.get_cached_file("exchange_info.json")
+        snapshot = None
+        if os.path.exists(snapshotFile):
+            with open(snapshotFile, "r") as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != EXCHANGE_INFO_SNAPSHOT_VERSION:
+                snapshot = None
+
+        if snapshot is not None:
+            age = datetime.now() - datetime.fromisoformat(snapshot["time"])
+            if self.offline or age <= maxAge:
+                return set(snapshot["symbols"])
+        if self.offline:
+            print("Offline mode: exchange info snapshot not found, binance api prices are disabled")
+            return set()
+
+        try:
+            exchangeInfo = self.client.exchange_info()
+        except Exception as e:
+            if snapshot is None:
+                raise e
+            print(f"Unable to get exchange info from binance, using snapshot of {snapshot['time']}: {e}")
+            return set(snapshot["symbols"])
+        symbols = set(
             [Symbol(s["baseAsset"], s["quoteAsset"]).key
              for s
              in exchangeInfo["symbols"]])
-        self.symbols = set(self.symbols_active).union(known_symbols)
-        self.df = None
-        self.df_cache = {}
-        self.files_cache_dir = filesCacheDir
-        if not os.path.exists(self.files_cache_dir):
-            os.makedirs(self.files_cache_dir)
+        with open(snapshotFile + ".tmp", "w") as f:
+            json.dump({
+                "version": EXCHANGE_INFO_SNAPSHOT_VERSION,
+                "time": datetime.now().isoformat(),
+                "symbols": sorted(symbols)
+            }, f)
+        os.replace(snapshotFile + ".tmp", snapshotFile)
+        return symbols
     
-    def merge(self, other: "PriceProvider") -> None:
-        """copy all prices from other to self"""
-        with Session(self.db) as mySession: 
-            with Session(other.db) as session:
-                for price in session.query(Price).all(): 
-                    # check if the price is already in the db
-                    stmt = (
-                        select(Price)
-                        .where(Price.asset == price.asset)
-                        .where(Price.quoteAsset == price.quoteAsset)
-                        .where(Price.time == price.time)
-                        .limit(1)
-                    )
-                    if mySession.execute(stmt).scalar_one_or_none():
-                        continue
-                    mySession.add(Price(asset=price.asset, quoteAsset=price.quoteAsset, time=price.time, price=price.price))
-            mySession.commit()
+    def merge(self, *others: "PriceProvider | str") -> int:
+        """copy all prices from others ( price providers or price db files, also with the old schema ) to self,
+           prices already in self are kept unless they are missing ones. Returns the number of prices added"""
+        self.flush()
+        added = 0
+        with self.db.connect() as connection:
+            for other in others:
+                if isinstance(other, PriceProvider):
+                    other.flush()
+                    other = other.db.url.database
+                connection.exec_driver_sql("ATTACH DATABASE ? AS other", (other,))
+                if _has_legacy_prices(connection, "other"):
+                    added += _copy_legacy_prices(connection, "other")
+                else:
+                    # asset ids are different in each db, prices are matched by asset name
+                    connection.exec_driver_sql("INSERT OR IGNORE INTO assets (name) SELECT name FROM other.assets")
+                    tables = set(connection.exec_driver_sql(
+                        "SELECT name FROM other.sqlite_master WHERE type = 'table'").scalars())
+                    for table, column in PRICE_TABLES.values():
+                        if table.__tablename__ not in tables:
+                            continue  # db with an older schema
+                        result = connection.exec_driver_sql(
+                            f"INSERT INTO {table.__tablename__} (asset, quoteAsset, {column}, price) "
+                            f"SELECT a.id, q.id, p.{column}, p.price FROM other.{table.__tablename__} p "
+                            f"JOIN other.assets oa ON oa.id = p.asset JOIN other.assets oq ON oq.id = p.quoteAsset "
+                            f"JOIN assets a ON a.name = oa.name JOIN assets q ON q.name = oq.name WHERE true "
+                            f"{_KEEP_PRICE_ON_CONFLICT.format(table=table.__tablename__, column=column)}")
+                        added += result.rowcount
+                connection.commit()
+                connection.exec_driver_sql("DETACH DATABASE other")
+        with Session(self.db) as session:
+            self.asset_ids = {asset.name: asset.id for asset in session.scalars(select(Asset))}
+        # the misses in the cache could have been filled by the merged prices
+        self.price_cache.remove_if(lambda price: price is None)
+        return added
     
     def get_cached_file(self, file_name: str) -> str:
         return os.path.join(self.files_cache_dir, file_name)
     
-    def _download_close_price(self, symbol: Symbol, time: datetime) -> float:
-        if not symbol.key in self.symbols_active:
+    def _rest_look_back(self, granularity: Granularity) -> int:
+        # at minute granularity the price is the last close in the 6 hours before time,
+        # the close of an hour or of a day is taken as it is
+        return REST_LOOK_BACK if granularity == Granularity.Minute else 0
+
+    def _download_close_price(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
+        if self.offline or not symbol.key in self.symbols_active:
             return None
 
-        # get it from binance
-        look_back = 60 * 6  # 6 hours
+        # get the price from the klines already downloaded or download them from binance
+        slot = price_slot(time, granularity)
+        lookBack = self._rest_look_back(granularity)
+        if not self._is_listed(symbol, (slot - lookBack) * granularity.value, (slot + 1) * granularity.value - 1):
+            return None
+        windows = self.rest_klines.setdefault((symbol.id, granularity), MinuteCloseWindows())
+        found, price = windows.get(slot, lookBack)
+        if not found:
+            self._download_klines(symbol, slot - lookBack, granularity)
+            found, price = windows.get(slot, lookBack)
+        # price is None if there is no price for this symbol at this time
+        return price
+
+    def _download_klines(self, symbol: Symbol, firstSlot: int, granularity: Granularity = Granularity.Minute) -> int:
+        """ download the largest window of klines ( 1m, 1h or 1d ) allowed by binance api starting at the period firstSlot,
+            every kline is stored in the db at its own period. Returns the last period of the window"""
+        lastSlot = min(firstSlot + REST_KLINES_LIMIT - 1,
+                       epoch_minute(datetime.now(timezone.utc)) // granularity.value - 1)  # future klines are not known yet
+        start = systime.perf_counter()
         klines = self.client.klines(
             symbol=f"{symbol.baseAsset}{symbol.quoteAsset}",
-            interval="1m",
-            startTime=int((time.timestamp() - 60 * look_back) * 1000),
-            endTime=int(time.timestamp() * 1000),
-            limit=look_back+1,
+            interval=granularity.interval,
+            startTime=firstSlot * granularity.value * 60000,
+            endTime=lastSlot * granularity.value * 60000,
+            limit=REST_KLINES_LIMIT,
         )
-        if len(klines) > 0:
-            return float(klines[-1][4])
-        # there is no price for this symbol at this time
-        return None
+        self.metrics.record("rest_call", symbol.key, datetime.fromtimestamp(firstSlot * granularity.value * 60, timezone.utc),
+                            len(klines) > 0, systime.perf_counter() - start)
+        closes = {int(kline[0]) // 60000 // granularity.value: float(kline[4]) for kline in klines}
+        self.rest_klines.setdefault((symbol.id, granularity), MinuteCloseWindows()).add(firstSlot, lastSlot, closes)
+        self._insert_slot_prices(symbol, closes, granularity, addToCache=False)
+        return lastSlot
+
+    def _download_kline_windows(self, symbol: Symbol, times: list[datetime], granularity: Granularity = Granularity.Minute) -> None:
+        """ download the klines needed for all the times merging nearby times in the same api call"""
+        if self.offline or not symbol.key in self.symbols_active:
+            return
+        windows = self.rest_klines.setdefault((symbol.id, granularity), MinuteCloseWindows())
+        lookBack = self._rest_look_back(granularity)
+        lastSlot = None
+        for slot in sorted(set(price_slot(time, granularity) for time in times)):
+            if lastSlot is not None and slot <= lastSlot:
+                continue
+            if windows.covers(slot - lookBack, slot):
+                continue
+            if not self._is_listed(symbol, (slot - lookBack) * granularity.value, (slot + 1) * granularity.value - 1):
+                continue
+            lastSlot = self._download_klines(symbol, slot - lookBack, granularity)
+
+    def _is_listed(self, symbol: Symbol, firstMinute: int, lastMinute: int) -> bool:
+        """ False if binance api has no klines of symbol between firstMinute and lastMinute,
+            the listing of an active symbol is asked to binance once and kept in the manifest"""
+        if symbol.key not in self.manifest.listings:
+            now = epoch_minute(datetime.now(timezone.utc))
+            start = systime.perf_counter()
+            klines = self.client.klines(
+                symbol=f"{symbol.baseAsset}{symbol.quoteAsset}",
+                interval="1m",
+                startTime=0,
+                endTime=now * 60000,
+                limit=1,
+            )
+            self.metrics.record("rest_listing", symbol.key, datetime.now(timezone.utc), len(klines) > 0,
+                                systime.perf_counter() - start)
+            # active symbols are still listed, so the listing has no end
+            self.manifest.set_listing(symbol.key, int(klines[0][0]) // 60000 if len(klines) > 0 else now, None)
+        return self.manifest.is_listed(symbol.key, firstMinute, lastMinute)
+
+    def _get_price_from_db(self, symbol: Symbol, slot: int, granularity: Granularity = Granularity.Minute) -> tuple[bool, float]:
+        """ get price of symbol at the period slot if there was a market for symbol or reverse symbol"""
+        pendingKey = (symbol, granularity, slot)
+        if pendingKey in self.pending_prices:
+            return (True, self.pending_prices[pendingKey])
+        assetId = self._get_asset_id(symbol.baseAsset)
+        quoteAssetId = self._get_asset_id(symbol.quoteAsset)
+        if assetId is None or quoteAssetId is None:
+            return (False, None)
 
-    def _get_price_from_db(self, symbol: Symbol, time: datetime) -> tuple[bool, float]:
-        """ get price of symbol at time if there was a market for symbol or reverse symbol at time"""
-        stmt = (
-            select(Price)
-            .where(Price.asset == symbol.baseAsset)
-            .where(Price.quoteAsset == symbol.quoteAsset)
-            .where(Price.time == time)
-            .limit(1)
-        )
-    
         with Session(self.db) as self.current_session:
-            resultSet = self.current_session.execute(stmt).scalar_one_or_none()
+            resultSet = self.current_session.get(PRICE_TABLES[granularity][0], (assetId, quoteAssetId, slot))
             if resultSet:
                 return (True, resultSet.price)  
             else:
                 return (False, None)
 
-    def _download_close_price_from_binance_data(self, symbol: Symbol, time: datetime) -> float:
+    def _get_prices_from_minutes(self, symbol: Symbol, slots: list[int], granularity: Granularity) -> dict[int, float]:
+        """ hourly or daily prices taken from the minute prices in the db ( i.e. migrated from the old schema ),
+            the close of a period is the price at the minute it ends or else at its last minute. A single query"""
+        found = dict(self._query_db_prices(
+            symbol, min(slots) * granularity.value, (max(slots) + 1) * granularity.value, Granularity.Minute))
+        prices = {}
+        for slot in slots:
+            end = (slot + 1) * granularity.value
+            price = found.get(end)
+            if price is None:
+                price = found.get(end - 1)
+            if price is not None:
+                prices[slot] = price
+        return prices
+
+    def _get_asset_id(self, name: str) -> int:
+        """ id of the asset in the db, None if the db has no prices of the asset"""
+        if name not in self.asset_ids:
+            # the asset could have been added by another process
+            with Session(self.db) as session:
+                assetId = session.scalar(select(Asset.id).where(Asset.name == name))
+            if assetId is None:
+                return None
+            self.asset_ids[name] = assetId
+        return self.asset_ids[name]
+
+    def _price_cache_key(self, symbol: Symbol, slot: int, granularity: Granularity = Granularity.Minute) -> tuple[int, bool]:
+        """ both directions of a pair share the same cache entry, returns the key and True if symbol is the reversed one"""
+        slot = slot * 4 + GRANULARITY_CODES[granularity]
+        if symbol.baseAsset <= symbol.quoteAsset:
+            return ((slot << SYMBOL_ID_BITS) | symbol.id, False)
+        return ((slot << SYMBOL_ID_BITS) | symbol.reverse().id, True)
+
+    def _get_price_from_cache(self, symbol: Symbol, slot: int, granularity: Granularity = Granularity.Minute) -> tuple[bool, float]:
+        key, reversed = self._price_cache_key(symbol, slot, granularity)
+        found, price = self.price_cache.lookup(key)
+        if found and reversed and price is not None:
+            price = 1 / price
+        return (found, price)
+
+    def _add_price_to_cache(self, symbol: Symbol, slot: int, price: float, granularity: Granularity = Granularity.Minute) -> None:
+        key, reversed = self._price_cache_key(symbol, slot, granularity)
+        if reversed and price is not None:
+            price = 1 / price
+        self.price_cache.put(key, price)
+
+    def _get_store_file(self, symbol: Symbol, year: int, month: int, granularity: Granularity = Granularity.Minute) -> str:
+        return self.get_cached_file(
+            f"{ArchiveDownloader.archive_name(symbol.key, year, month, granularity.interval)}.close")
+
+    def _get_store_month(self, time: datetime, granularity: Granularity = Granularity.Minute) -> tuple[int, int, int]:
+        """ (year, month, period) of the store holding the price at time"""
+        slot = price_slot(time, granularity)
+        if granularity == Granularity.Minute:
+            # remove one minute from time to get the month because for the first minute of the month we need the last price of previous month
+            monthTime = time - timedelta(minutes=1)
+        else:
+            # hours and days never span two months
+            monthTime = datetime.fromtimestamp(slot * granularity.value * 60, timezone.utc)
+        return monthTime.year, monthTime.month, slot
+
+    def _get_close_price_from_stores(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
+        """ price from the stores already in the files cache, never downloads.
+            Hourly and daily stores are derived from the minute store when missing"""
+        year, month, slot = self._get_store_month(time, granularity)
+        if self.downloader.is_missing(symbol.key, year, month):
+            return None
+        storeFile = self._get_store_file(symbol, year, month, granularity)
+        if not os.path.exists(storeFile) and \
+                (granularity == Granularity.Minute or not self._derive_store(symbol, year, month, granularity)):
+            return None
+        return self._get_minute_store(symbol, storeFile, year, month, granularity).get_slot(
+            slot, self.max_staleness // granularity.value)
+
+    def _derive_store(self, symbol: Symbol, year: int, month: int, granularity: Granularity) -> bool:
+        """ compute the hourly or daily store of a month from its minute store, False if there is no minute store"""
+        minuteStoreFile = self._get_store_file(symbol, year, month)
+        if not os.path.exists(minuteStoreFile):
+            return False
+        MinuteCloseStore.derive(minuteStoreFile, self._get_store_file(symbol, year, month, granularity), granularity.value)
+        return True
+
+    def _download_close_price_from_binance_data(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
         if not symbol.key in self.symbols:
             return None
         # to download prices here https://data.binance.vision/
-        # format https://data.binance.vision/data/spot/monthly/klines/PIVXETH/1m/PIVXETH-1m-2018-02.zip
-        # download the zip and extract the csv
-        # then use the csv to get the price
-        # remove one minute from time to get the month because for the first minute of the month we need the last price of previous month
-        monthTime = time - timedelta(minutes=1)
-        url = f"https://data.binance.vision/data/spot/monthly/klines/{symbol.baseAsset}{symbol.quoteAsset}/1m/{symbol.baseAsset}{symbol.quoteAsset}-1m-{monthTime.year}-{monthTime.month:02}.zip"
-        # download the zip
-        zipFIle = self.get_cached_file(
-            f"{symbol.baseAsset}{symbol.quoteAsset}-1m-{monthTime.year}-{monthTime.month:02}.zip")
-        csvFile = self.get_cached_file(
-            f"{symbol.baseAsset}{symbol.quoteAsset}-1m-{monthTime.year}-{monthTime.month:02}.csv")
-
-        if not os.path.exists(zipFIle):
-            with open(zipFIle, "wb") as f:
-                f.write(requests.get(url).content)
-
-        # extract the csv
-        try:
-            if not os.path.exists(csvFile):
-                with zipfile.ZipFile(zipFIle, "r") as zip_ref:
-                    zip_ref.extractall(self.files_cache_dir)  # extract to current directory
-        except:
+        # the downloaded zip is converted to a store that is used to get the price
+        year, month, slot = self._get_store_month(time, granularity)
+        if self.downloader.is_missing(symbol.key, year, month):
             return None
-        # read the csv
-        if not csvFile in self.df_cache:
-            self.df_cache[csvFile] = pd.read_csv(
-                csvFile,
-                header=None,
-                engine="c",
-                names=[
-                    "timestamp",
-                    "open",
-                    "high",
-                    "low",
-                    "close",
-                    "volume",
-                    "closeTime",
-                    "quoteAssetVolume",
-                    "numberOfTrades",
-                    "takerBuyBaseAssetVolume",
-                    "takerBuyQuoteAssetVolume",
-                    "ignore",
-                ],
-                index_col='timestamp',
-                usecols=["timestamp", "close"],
-                memory_map=True
-            )
-        df = self.df_cache[csvFile]
-        time = time.replace(second=0, microsecond=0)
-        rowIndex = time.timestamp() * 1000
 
-        if rowIndex in df.index:
-            return df.loc[time.timestamp() * 1000]['close']
-        return None
+        storeFile = self._get_store_file(symbol, year, month, granularity)
+        if not os.path.exists(storeFile):
+            if os.path.exists(self._get_store_file(symbol, year, month)):
+                self._derive_store(symbol, year, month, granularity)
+            elif not self._download_store(symbol, year, month, granularity):
+                return None
+
+        return self._get_minute_store(symbol, storeFile, year, month, granularity).get_slot(
+            slot, self.max_staleness // granularity.value)
+
+    def _download_store(self, symbol: Symbol, year: int, month: int, granularity: Granularity = Granularity.Minute) -> bool:
+        """ download the archive of the klines of granularity ( 1m, 1h or 1d ) of a month and convert it to a store,
+            hourly and daily archives are much smaller than the minute ones. False if the archive is missing"""
+        start = systime.perf_counter()
+        if self.offline:
+            zipFIle = self.downloader.get_cached(symbol.key, year, month, granularity.interval)
+        else:
+            zipFIle = self.downloader.download(symbol.key, year, month, granularity.interval)
+        self.metrics.record("download", symbol.key, datetime(year, month, 1), zipFIle is not None, systime.perf_counter() - start)
+        return zipFIle is not None and self._build_minute_store(
+            symbol.key, zipFIle, self._get_store_file(symbol, year, month, granularity), year, month, granularity)
 
-    def get_price(self, symbol: Symbol, time: datetime) -> float:
+    def _get_minute_store(self, symbol: Symbol, storeFile: str, year: int, month: int,
+                          granularity: Granularity = Granularity.Minute) -> MinuteCloseStore:
+        key = (((month_index(year, month) << 2) | GRANULARITY_CODES[granularity]) << SYMBOL_ID_BITS) | symbol.id
+        found, store = self.df_cache.lookup(key)
+        if not found:
+            store = MinuteCloseStore(storeFile, year, month, granularity.value)
+            self.df_cache.put(key, store)
+        return store
+
+    def _build_minute_store(self, pair: str, zipFile: str, storeFile: str, year: int, month: int,
+                            granularity: Granularity = Granularity.Minute) -> bool:
+        """ convert a downloaded archive to a store, the archive is not needed anymore and is removed"""
+        start = systime.perf_counter()
+        try:
+            MinuteCloseStore.build_from_zip(zipFile, storeFile, year, month, granularity.value)
+        except zipfile.BadZipFile:
+            self.metrics.record("csv_parse", pair, datetime(year, month, 1), False, systime.perf_counter() - start)
+            return False
+        self.metrics.record("csv_parse", pair, datetime(year, month, 1), True, systime.perf_counter() - start)
+        os.remove(zipFile)
+        return True
+
+    def archives_for_conversions(self, requests: Iterable[tuple[str, str, datetime]],
+                                 granularity: Granularity = Granularity.Minute) -> set[tuple[str, int, int]]:
+        """ the (pair, year, month) archives needed to convert asset to destinationAsset at time for all the requests,
+            using for each conversion the first route made of known markets"""
+        months = set()
+        for asset, dest, time in requests:
+            if asset != dest:
+                year, month, slot = self._get_store_month(time, granularity)
+                months.add((asset, dest, year, month))
+        archives = set()
+        for asset, dest, year, month in months:
+            time = datetime(year, month, 1)
+            for route in self.route_planner.candidate_routes(asset, dest, time):
+                legs = list(zip(route[:-1], route[1:]))
+                if all(self.has_market(base, quote, time) for base, quote in legs):
+                    for base, quote in legs:
+                        pair = f"{base}{quote}" if f"{base}{quote}" in self.symbols else f"{quote}{base}"
+                        archives.add((pair, year, month))
+                    break
+        return archives
+
+    def download_archives(self, archives: Iterable[tuple[str, int, int]], progress=None,
+                          granularity: Granularity = Granularity.Minute) -> dict[tuple[str, int, int], str]:
+        """ download in parallel the (pair, year, month) archives of the klines of granularity that are not yet
+            in the files cache and convert them to stores, returns the path of the store of each archive ( None if missing ).
+            Hourly and daily stores are derived from the minute stores already in the files cache"""
+        stores = {(pair, year, month): self.get_cached_file(
+                      f"{ArchiveDownloader.archive_name(pair, year, month, granularity.interval)}.close")
+                  for pair, year, month in archives}
+        missing = []
+        for (pair, year, month), storeFile in stores.items():
+            if os.path.exists(storeFile):
+                continue
+            minuteStoreFile = self.get_cached_file(f"{ArchiveDownloader.archive_name(pair, year, month)}.close")
+            if os.path.exists(minuteStoreFile):
+                MinuteCloseStore.derive(minuteStoreFile, storeFile, granularity.value)
+            else:
+                missing.append((pair, year, month))
+        for archive, zipFile in self.downloader.download_all(missing, progress, granularity.interval).items():
+            if zipFile is None or not self._build_minute_store(archive[0], zipFile, stores[archive], archive[1], archive[2], granularity):
+                stores[archive] = None
+        return stores
+
+    def get_price(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
         """get price of symbol at time if there was a market for symbol or reverse symbol at time"""
         if symbol.baseAsset == symbol.quoteAsset:
             return 1
 
-        indb, price = self._get_price_from_db(symbol, time)
-        if indb:
+        # prices are stored by period ( minute, hour or day )
+        slot = price_slot(time, granularity)
+        cached, price = self._get_price_from_cache(symbol, slot, granularity)
+        if cached:
+            self.metrics.memory_hits += 1
             return price
+        self.metrics.memory_misses += 1
 
-        # try to get reverse symbol
-        indb, price = self._get_price_from_db(symbol.reverse(), time)
+        start = systime.perf_counter()
+        indb, price = self._get_price_from_db(symbol, slot, granularity)
+        if not indb:
+            # try to get reverse symbol
+            indb, price = self._get_price_from_db(symbol.reverse(), slot, granularity)
+            if indb and price is not None:
+                price = 1 / price
+        if not indb and granularity != Granularity.Minute:
+            price = self._get_prices_from_minutes(symbol, [slot], granularity).get(slot)
+            if price is not None:
+                # the derived row is written to the table of the granularity
+                self._insert_slot_prices(symbol, {slot: price}, granularity)
+                indb = True
+        self.metrics.record("db", symbol.key, time, indb, systime.perf_counter() - start)
         if indb:
-            if price is None:
-                return None
-            return 1 / price
+            self._add_price_to_cache(symbol, slot, price, granularity)
+            return price
 
-        # try to downlaod price from binance
-        price = self._download_close_price(symbol, time)
-        if price is None:
-            price = self._download_close_price(symbol.reverse(), time)
-            if not price is None:
-                price = 1 / price
+        price = self._resolve_prices(symbol, [time], granularity)[time]
 
-        # things get complicated here because if symbol is delisted we need
-        if price is None:
-            price = self._download_close_price_from_binance_data(symbol, time)
-        if price is None:
-            price = self._download_close_price_from_binance_data(
-                symbol.reverse(), time)
-            if not price is None:
-                price = 1 / price
- 
         # insert price into db
-        with Session(self.db) as session:
-            session.add(
-                Price(asset=symbol.baseAsset, quoteAsset=symbol.quoteAsset,
-                      time=time, price=price))
-            session.commit()
+        self._insert_slot_prices(symbol, {slot: price}, granularity)
 
         return price
 
-    def convert(self, asset: AssetAmount, destinationAsset: str, time: datetime) -> AssetAmount:
-        if asset.symbol == destinationAsset:
-            return asset
-        price = self.get_price(Symbol(asset.symbol, destinationAsset), time)
-        if price is not None:
-            return AssetAmount(destinationAsset, asset.amount * price)
+    def _resolve_prices(self, symbol: Symbol, times: list[datetime], granularity: Granularity = Granularity.Minute) -> dict[datetime, float]:
+        """ get prices that are not in the db from binance, each source tier is visited once for all the times"""
+        prices = {time: None for time in times}
+        # first try the archives already downloaded, then downlaod price from binance api, then from binance data archives
+        # ( things get complicated here because if symbol is delisted we need the archives )
+        for name, tier in (("stores", self._get_close_price_from_stores),
+                           ("rest", self._download_close_price),
+                           ("archive", self._download_close_price_from_binance_data)):
+            pending = [time for time, price in prices.items() if price is None]
+            if tier == self._download_close_price:
+                # nearby times are downloaded with a single api call
+                self._download_kline_windows(symbol, pending, granularity)
+                self._download_kline_windows(symbol.reverse(), pending, granularity)
+            for time in pending:
+                start = systime.perf_counter()
+                price = tier(symbol, time, granularity)
+                if price is None:
+                    price = tier(symbol.reverse(), time, granularity)
+                    if not price is None:
+                        price = 1 / price
+                prices[time] = price
+                self.metrics.record(name, symbol.key, time, price is not None, systime.perf_counter() - start)
+        return prices
+
+    def get_prices(self, symbol: Symbol, times: np.ndarray) -> np.ndarray:
+        """ vectorized get_price: prices of symbol at all the times ( numpy datetime64 array, UTC ), NaN where there is no price.
+            Uses a single db range query and array lookups in the minute stores, the remaining prices are prefetched."""
+        times = np.asarray(times, dtype="datetime64[us]")
+        prices = np.full(len(times), np.nan)
+        if symbol.baseAsset == symbol.quoteAsset:
+            prices[:] = 1
+            return prices
+        if len(times) == 0:
+            return prices
+        resolved = np.zeros(len(times), dtype=bool)
+
+        minutes = times.astype("datetime64[m]").astype(np.int64)
+
+        # db tier, misses stored in the db are resolved as NaN
+        self.flush()
+        found = {}
+        for minute, price in self._query_db_prices(symbol, int(minutes.min()), int(minutes.max())):
+            found[minute] = np.nan if price is None else price
+        if len(found) > 0:
+            keys = np.array(list(found.keys()), dtype=np.int64)
+            values = np.array(list(found.values()), dtype=np.float64)
+            order = np.argsort(keys)
+            keys, values = keys[order], values[order]
+            positions = np.minimum(np.searchsorted(keys, minutes), len(keys) - 1)
+            resolved = keys[positions] == minutes
+            prices[resolved] = values[positions[resolved]]
+
+        # minute stores tier, one vectorized lookup per month
+        # as in _get_store_month, the first minute of the month is in the previous month store
+        months = (times - np.timedelta64(1, "m")).astype("datetime64[M]")
+        for month in np.unique(months[~resolved]):
+            year, monthNumber = int(month.astype(np.int64) // 12 + 1970), int(month.astype(np.int64) % 12 + 1)
+            inMonth = (months == month) & ~resolved
+            for storeSymbol, invert in ((symbol, False), (symbol.reverse(), True)):
+                storeFile = self._get_store_file(storeSymbol, year, monthNumber)
+                if not os.path.exists(storeFile):
+                    continue
+                store = self._get_minute_store(storeSymbol, storeFile, year, monthNumber)
+                values = store.get_many(minutes[inMonth], self.max_staleness)
+                if invert:
+                    values = 1 / values
+                hits = np.flatnonzero(inMonth)[~np.isnan(values)]
+                prices[hits] = values[~np.isnan(values)]
+                resolved[hits] = True
+                inMonth &= ~resolved
+
+        # remaining prices come from the network tiers
+        if not resolved.all():
+            missing = [time.astype(datetime) for time in times[~resolved]]
+            self.prefetch([(symbol, time) for time in missing])
+            prices[~resolved] = [np.nan if price is None else price
+                                 for price in (self.get_price(symbol, time) for time in missing)]
+        return prices
+
+    def _insert_prices(self, symbol: Symbol, prices: dict[datetime, float], granularity: Granularity = Granularity.Minute) -> None:
+        self._insert_slot_prices(symbol, {price_slot(time, granularity): price for time, price in prices.items()}, granularity)
 
-        symbOnBtc_price = self.get_price(Symbol(asset.symbol, "BTC"), time)
-        destinationAssetonBtc_price = self.get_price(Symbol(destinationAsset, "BTC"), time)
-        if symbOnBtc_price is not None and destinationAssetonBtc_price is not None:
-            return AssetAmount(destinationAsset, asset.amount * symbOnBtc_price / destinationAssetonBtc_price)
+    def _insert_slot_prices(self, symbol: Symbol, prices: dict[int, float], granularity: Granularity = Granularity.Minute,
+                            addToCache: bool = True) -> None:
+        """ store prices by period ( misses included ) in the cache and in the write-behind buffer of the db"""
+        if self.first_pending is None and len(prices) > 0:
+            self.first_pending = systime.monotonic()
+        for slot, price in prices.items():
+            self.pending_prices[(symbol, granularity, slot)] = price
+            if addToCache:
+                self._add_price_to_cache(symbol, slot, price, granularity)
+        if len(self.pending_prices) >= self.flush_size or \
+                (self.first_pending is not None and systime.monotonic() - self.first_pending >= self.flush_interval):
+            self.flush()
 
-        # get price on USDT
-        symbOnUsdt_price = self.get_price(Symbol(asset.symbol, "USDT"), time)
-        destinationAssetonUsdt_price = self.get_price(Symbol(destinationAsset, "USDT"), time)
-        if symbOnUsdt_price is not None and destinationAssetonUsdt_price is not None:
-            return AssetAmount(destinationAsset, asset.amount * symbOnUsdt_price / destinationAssetonUsdt_price)
+    def _query_db_prices(self, symbol: Symbol, firstSlot: int, lastSlot: int,
+                         granularity: Granularity = Granularity.Minute) -> list[tuple[int, float]]:
+        """ (period, price) of all the prices of symbol or reverse symbol in the db between firstSlot and lastSlot,
+            using a single query. When both are present the direct symbol has precedence over the reverse"""
+        assetId = self._get_asset_id(symbol.baseAsset)
+        quoteAssetId = self._get_asset_id(symbol.quoteAsset)
+        if assetId is None or quoteAssetId is None:
+            return []
+        table, column = PRICE_TABLES[granularity]
+        stmt = (
+            select(table.asset, getattr(table, column), table.price)
+            .where(table.asset.in_([assetId, quoteAssetId]))
+            .where(table.quoteAsset.in_([assetId, quoteAssetId]))
+            .where(getattr(table, column) >= firstSlot)
+            .where(getattr(table, column) <= lastSlot)
+        )
+        found = {}
+        start = systime.perf_counter()
+        with Session(self.db) as session:
+            for asset, slot, price in session.execute(stmt):
+                if asset == assetId:
+                    found[slot] = price
+                elif slot not in found:
+                    found[slot] = None if price is None else 1 / price
+        self.metrics.record("db_query", symbol.key, datetime.fromtimestamp(firstSlot * granularity.value * 60, timezone.utc),
+                            len(found) > 0, systime.perf_counter() - start)
+        return list(found.items())
+
+    def _prefetch_from_db(self, symbol: Symbol, times: list[datetime], granularity: Granularity = Granularity.Minute) -> list[datetime]:
+        """ load in the cache the prices of symbol ( or reverse symbol ) at times that are in the db,
+            using a single query. Returns the times that were not found."""
+        slots = {time: price_slot(time, granularity) for time in times}
+        found = dict(self._query_db_prices(symbol, min(slots.values()), max(slots.values()), granularity))
+        wanted = set(slots.values())
+        if granularity != Granularity.Minute and not wanted.issubset(found):
+            derived = self._get_prices_from_minutes(symbol, sorted(wanted.difference(found)), granularity)
+            self._insert_slot_prices(symbol, derived, granularity, addToCache=False)
+            found.update(derived)
+        for slot, price in found.items():
+            if slot in wanted:
+                self._add_price_to_cache(symbol, slot, price, granularity)
+        return [time for time in times if slots[time] not in found]
+
+    def prefetch(self, requests: Iterable[tuple[Symbol, datetime]], granularity: Granularity = Granularity.Minute) -> None:
+        """ resolve in advance the prices of all the (symbol, time) in requests, so that later calls to get_price
+            are served from memory. Requests are grouped by symbol and month and each group visits every source
+            tier ( db, binance api, binance data archives ) only once."""
+        self.flush()  # so that the db queries see all the known prices
+        groups: dict[tuple[str, str, int, int], set[datetime]] = {}
+        for symbol, time in requests:
+            if symbol.baseAsset == symbol.quoteAsset or \
+                    self._get_price_from_cache(symbol, price_slot(time, granularity), granularity)[0]:
+                continue
+            groups.setdefault((symbol.baseAsset, symbol.quoteAsset, time.year, time.month), set()).add(time)
+
+        for (baseAsset, quoteAsset, year, month), times in groups.items():
+            symbol = Symbol(baseAsset, quoteAsset)
+            missing = self._prefetch_from_db(symbol, sorted(times), granularity)
+            if len(missing) > 0:
+                self._insert_prices(symbol, self._resolve_prices(symbol, missing, granularity), granularity)
+
+    def prefetch_conversions(self, requests: Iterable[tuple[str, str, datetime]],
+                             granularity: Granularity = Granularity.Minute) -> None:
+        """ resolve in advance the prices needed to convert asset to destinationAsset at time for
+            all (asset, destinationAsset, time) in requests, following the same routes used by convert"""
+        pending = [(asset, dest, time, self.route_planner.candidate_routes(asset, dest, time))
+                   for asset, dest, time in requests if asset != dest]
+        while len(pending) > 0:
+            # at each round the next candidate route of every unresolved conversion is prefetched
+            routes = []
+            for asset, dest, time, candidates in pending:
+                route = next(candidates, None)
+                if route is not None:
+                    routes.append((asset, dest, time, candidates, route))
+            self.prefetch([(Symbol(route[i], route[i + 1]), time)
+                           for asset, dest, time, candidates, route in routes
+                           for i in range(len(route) - 1)], granularity)
+            pending = []
+            for asset, dest, time, candidates, route in routes:
+                if self._get_route_price(route, time, granularity) is None:
+                    pending.append((asset, dest, time, candidates))
+                else:
+                    self.route_planner.set_route(asset, dest, time, route)
 
+    def has_market(self, baseAsset: str, quoteAsset: str, time: datetime) -> bool:
+        """ True if there is a known market for the pair ( in any direction ) that is not known to be missing
+            in the month of time, according to the listing periods and missing archives of the manifest"""
+        symbol = Symbol(baseAsset, quoteAsset)
+        pairs = self.markets.get(symbol.id)
+        if pairs is None:
+            pairs = self.markets[symbol.id] = [s.key for s in (symbol, symbol.reverse()) if s.key in self.symbols]
+        return any(not self.manifest.is_archive_missing(pair, time.year, time.month) for pair in pairs)
+
+    def _get_route_price(self, route: list[str], time: datetime, granularity: Granularity = Granularity.Minute) -> float:
+        """ price of route[0] in route[-1] going through the markets of route"""
+        price = 1
+        for i in range(len(route) - 1):
+            legPrice = self.get_price(Symbol(route[i], route[i + 1]), time, granularity)
+            if legPrice is None:
+                return None
+            price *= legPrice
+        return price
+
+    def convert(self, asset: AssetAmount, destinationAsset: str, time: datetime,
+                granularity: Granularity = Granularity.Minute) -> AssetAmount:
+        if asset.symbol == destinationAsset:
+            return asset
+        for route in self.route_planner.candidate_routes(asset.symbol, destinationAsset, time):
+            price = self._get_route_price(route, time, granularity)
+            if price is not None:
+                self.route_planner.set_route(asset.symbol, destinationAsset, time, route)
+                return AssetAmount(destinationAsset, asset.amount * price)
 
 
 known_symbols = set([
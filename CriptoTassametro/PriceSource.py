@@ -0,0 +1,41 @@
+from datetime import datetime
+from typing import Iterable
+import numpy as np
+from .Components import Symbol, AssetAmount, Granularity
+
+
+class PriceSource:
+    ''' The prices used by Tassametro and BinanceHistoryParser.
+        Subclasses must implement get_price, the other methods have a default implementation based on it. '''
+
+    def get_price(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
+        '''price of symbol at time ( quoteAsset / baseAsset ) at the given granularity, None if there is no price'''
+        raise NotImplementedError()
+
+    def get_prices(self, symbol: Symbol, times: np.ndarray) -> np.ndarray:
+        '''prices of symbol at all the times ( numpy datetime64 array, UTC ), NaN where there is no price'''
+        prices = [self.get_price(symbol, time.astype("datetime64[us]").item())
+                  for time in np.asarray(times, dtype="datetime64[us]")]
+        return np.array([np.nan if price is None else price for price in prices], dtype=np.float64)
+
+    def convert(self, asset: AssetAmount, destinationAsset: str, time: datetime,
+                granularity: Granularity = Granularity.Minute) -> AssetAmount:
+        '''asset converted to destinationAsset at time, None if there is no price'''
+        if asset.symbol == destinationAsset:
+            return asset
+        price = self.get_price(Symbol(asset.symbol, destinationAsset), time, granularity)
+        if price is None:
+            return None
+        return AssetAmount(destinationAsset, asset.amount * price)
+
+    def prefetch(self, requests: Iterable[tuple[Symbol, datetime]], granularity: Granularity = Granularity.Minute) -> None:
+        '''hint that the prices (symbol, time) will be asked soon'''
+        pass
+
+    def prefetch_conversions(self, requests: Iterable[tuple[str, str, datetime]],
+                             granularity: Granularity = Granularity.Minute) -> None:
+        '''hint that the conversions (asset, destination asset, time) will be asked soon'''
+        pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Callable, Iterator
+from .Components import asset_id
+from .MinuteStore import month_index
+
+
+class RoutePlanner:
+    ''' Finds the paths that can be used to convert an asset to another one.
+        A path is a list of assets where each couple of consecutive assets is a market,
+        candidate paths are generated from the graph of known markets with the fewest hops first.
+        The path that worked for a conversion is remembered for the whole month. '''
+
+    # intermediate assets ordered by liquidity, BTC and USDT are always tried
+    intermediates = ["BTC", "USDT", "ETH", "BNB", "BUSD", "FDUSD"]
+    always_tried = ["BTC", "USDT"]
+
+    def __init__(self, hasMarket: Callable[[str, str, datetime], bool], maxHops: int = 3):
+        self.has_market = hasMarket
+        self.max_hops = maxHops
+        self.routes: dict[tuple[int, int, int], list[str]] = {}  # (asset id, destination asset id, month index)
+
+    def get_route(self, asset: str, destinationAsset: str, time: datetime) -> list[str]:
+        return self.routes.get((asset_id(asset), asset_id(destinationAsset), month_index(time.year, time.month)))
+
+    def set_route(self, asset: str, destinationAsset: str, time: datetime, route: list[str]) -> None:
+        self.routes[(asset_id(asset), asset_id(destinationAsset), month_index(time.year, time.month))] = route
+
+    def candidate_routes(self, asset: str, destinationAsset: str, time: datetime) -> Iterator[list[str]]:
+        '''all the possible paths from asset to destinationAsset, the cached one first then by number of hops'''
+        cached = self.get_route(asset, destinationAsset, time)
+        if cached is not None:
+            yield cached
+        for route in self._routes_by_hops(asset, destinationAsset, time):
+            if route != cached:
+                yield route
+
+    def _routes_by_hops(self, asset: str, destinationAsset: str, time: datetime) -> Iterator[list[str]]:
+        # the direct market is always tried as its price could be in the db
+        yield [asset, destinationAsset]
+        intermediates = [i for i in RoutePlanner.intermediates if i != asset and i != destinationAsset]
+        if self.max_hops >= 2:
+            for i in intermediates:
+                if i in RoutePlanner.always_tried or \
+                        (self.has_market(asset, i, time) and self.has_market(i, destinationAsset, time)):
+                    yield [asset, i, destinationAsset]
+        if self.max_hops >= 3:
+            for i in intermediates:
+                if not self.has_market(asset, i, time):
+                    continue
+                for j in intermediates:
+                    if j != i and self.has_market(i, j, time) and self.has_market(j, destinationAsset, time):
+                        yield [asset, i, j, destinationAsset]
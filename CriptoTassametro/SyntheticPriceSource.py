@@ -0,0 +1,137 @@
+import math
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterable
+import numpy as np
+from .Components import Symbol, AssetAmount, Granularity
+from .Caches import LruCache
+from .MinuteStore import epoch_minute, price_slot
+from .PriceSource import PriceSource
+
+ORIGIN = datetime(2021, 1, 1)  # every asset has its initial price at this time
+DAYS_PER_CHUNK = 1024  # daily prices are generated in chunks of this many days
+MINUTES_PER_DAY = 24 * 60
+
+
+class SyntheticPriceSource(PriceSource):
+    ''' Deterministic fake prices, for tests and benchmarks that must run without network.
+        Every asset has a value in a common unit that follows a seeded random walk: a daily walk
+        plus, inside each day, a brownian bridge at minute resolution that joins the prices of two consecutive days.
+        The price of a pair is the ratio of the values of its assets, so that cross rates are consistent
+        ( converting through any route gives the same result ).
+        The same seed always gives the same prices, whatever the order of the requests. '''
+
+    # initial value and daily volatility of the log price, other assets get them from the hash of their name
+    known_assets = {
+        "EUR": (1.1, 0.004),
+        "USDT": (1.0, 0.0005),
+        "BUSD": (1.0, 0.0005),
+        "USDC": (1.0, 0.0005),
+        "FDUSD": (1.0, 0.0005),
+        "BTC": (30000.0, 0.035),
+        "ETH": (1000.0, 0.045),
+        "BNB": (100.0, 0.04),
+    }
+
+    def __init__(self, seed: int = 0,
+                 assets: Iterable[str] = None,  # when given only these assets have a price
+                 cacheSize: int = 1000):  # number of days whose minute prices are kept in memory
+        self.seed = seed
+        self.assets = set(assets) if assets is not None else None
+        self.chunks: dict[tuple[str, int], np.ndarray] = {}
+        self.days = LruCache(cacheSize)
+
+    def _asset_id(self, asset: str) -> int:
+        return zlib.crc32(asset.encode())
+
+    def _parameters(self, asset: str) -> tuple[float, float]:
+        if asset in SyntheticPriceSource.known_assets:
+            return SyntheticPriceSource.known_assets[asset]
+        h = self._asset_id(asset)
+        return (10 ** ((h % 10000) / 2000 - 2), 0.03 + (h >> 16) % 50 / 1000)  # 0.01 - 100, 0.03 - 0.08
+
+    def _rng(self, asset: str, kind: int, index: int) -> np.random.Generator:
+        # indexes can be negative ( before ORIGIN ) while seeds must not
+        return np.random.default_rng([self.seed, self._asset_id(asset), kind, index + 2**31])
+
+    def _chunk(self, asset: str, chunk: int) -> np.ndarray:
+        '''log values at the start of the DAYS_PER_CHUNK + 1 days from chunk * DAYS_PER_CHUNK'''
+        key = (asset, chunk)
+        if key not in self.chunks:
+            initial, volatility = self._parameters(asset)
+            walk = np.concatenate(([0.0], np.cumsum(self._rng(asset, 0, chunk).standard_normal(DAYS_PER_CHUNK) * volatility)))
+            if chunk == 0:
+                start = math.log(initial)
+            elif chunk > 0:
+                start = self._chunk(asset, chunk - 1)[-1]
+            else:
+                start = self._chunk(asset, chunk + 1)[0] - walk[-1]
+            self.chunks[key] = start + walk
+        return self.chunks[key]
+
+    def _bridge(self, asset: str, day: int) -> np.ndarray:
+        '''brownian bridge of a day at minute resolution, zero at the start and at the end of the day'''
+        found, bridge = self.days.lookup((asset, day))
+        if not found:
+            walk = np.concatenate(([0.0], np.cumsum(self._rng(asset, 1, day).standard_normal(MINUTES_PER_DAY))))
+            bridge = walk[:-1] - np.arange(MINUTES_PER_DAY) / MINUTES_PER_DAY * walk[-1]
+            self.days.put((asset, day), bridge)
+        return bridge
+
+    def log_value(self, asset: str, minute: int) -> float:
+        '''natural logarithm of the value of asset at minute ( see epoch_minute )'''
+        day, minuteOfDay = divmod(minute - epoch_minute(ORIGIN), MINUTES_PER_DAY)
+        chunk, dayOfChunk = divmod(day, DAYS_PER_CHUNK)
+        levels = self._chunk(asset, chunk)
+        start, end = levels[dayOfChunk], levels[dayOfChunk + 1]
+        volatility = self._parameters(asset)[1] / math.sqrt(MINUTES_PER_DAY)
+        return start + (end - start) * minuteOfDay / MINUTES_PER_DAY + volatility * self._bridge(asset, day)[minuteOfDay]
+
+    def get_price(self, symbol: Symbol, time: datetime, granularity: Granularity = Granularity.Minute) -> float:
+        if symbol.baseAsset == symbol.quoteAsset:
+            return 1
+        if self.assets is not None and (symbol.baseAsset not in self.assets or symbol.quoteAsset not in self.assets):
+            return None
+        # the close of an hour or of a day is the price of its last minute
+        minute = (price_slot(time, granularity) + 1) * granularity.value - 1
+        return math.exp(self.log_value(symbol.baseAsset, minute) - self.log_value(symbol.quoteAsset, minute))
+
+
+def synthetic_history(prices: PriceSource, start: datetime, trades: int, seed: int = 0, currency: str = "EUR") -> list[str]:
+    ''' lines of a binance history csv ( header included ) made of a deposit of currency followed by trades
+        at the prices of prices. Like binance market orders, some trades are split in many fills with the same time
+        and the fee is paid in the bought asset ( 0.1% ) or in BNB ( 0.075% ) '''
+    rng = np.random.default_rng(seed)
+    markets = [("BTC", currency), ("ETH", currency), ("BNB", currency), ("ETH", "BTC"), ("BNB", "BTC")]
+    lines = ['"User_ID","UTC_Time","Account","Operation","Coin","Change","Remark"']
+    balances = {currency: 10.0 ** 7}
+
+    def add_line(time: datetime, operation: str, coin: str, change: float) -> None:
+        balances[coin] = balances.get(coin, 0) + change
+        lines.append(f'"111222333","{time:%Y-%m-%d %H:%M:%S}","Spot","{operation}","{coin}","{change:.8f}",""')
+
+    time = start
+    add_line(time, "Deposit", currency, balances.pop(currency))
+    for _ in range(trades):
+        time += timedelta(seconds=int(rng.integers(60, 36000)))
+        base, quote = markets[rng.integers(len(markets))]
+        price = prices.get_price(Symbol(base, quote), time)
+        amount = prices.convert(AssetAmount(currency, rng.uniform(50, 500)), base, time).amount
+        sell = balances.get(base, 0) > amount and rng.random() < 0.5
+        if not sell and balances.get(quote, 0) < amount * price * 1.01:
+            continue
+        bought = quote if sell else base
+        for fill in rng.dirichlet(np.ones(rng.integers(1, 4))) * amount:
+            if sell:
+                add_line(time, "Transaction Sold", base, -fill)
+                add_line(time, "Transaction Revenue", quote, fill * price)
+            else:
+                add_line(time, "Transaction Spend", quote, -fill * price)
+                add_line(time, "Transaction Buy", base, fill)
+            boughtAmount = fill * price if sell else fill
+            bnbFee = prices.convert(AssetAmount(bought, boughtAmount * 0.00075), "BNB", time).amount
+            if bought != "BNB" and balances.get("BNB", 0) > bnbFee and rng.random() < 0.5:
+                add_line(time, "Transaction Fee", "BNB", -bnbFee)
+            else:
+                add_line(time, "Transaction Fee", bought, -boughtAmount * 0.001)
+    return lines
@@ -1,5 +1,6 @@
 from datetime import datetime as dt
 from .PriceProvider import PriceProvider, Symbol
+from .PriceSource import PriceSource
 from .Components import *
 from .Portfolio import Portfolio
 import logging
@@ -16,13 +17,15 @@ class Tassametro:
     def __init__(self,
                  startTime: dt,
                  endTime: dt,
-                 pricesDb: PriceProvider,
+                 pricesDb: PriceSource,  # a PriceProvider or any other source of prices
                  portfolio: Portfolio,
                  deduce_fee: bool = True,
                  end_of_day_prices_for_fees: bool = True,  # use closing price from last day for fees (speeds up calculation)
                  end_of_day_prices_for_all: bool = False,  # use closing price from last day for all operations (speeds up calculation)
                  capital_gain_logger=dummy_logger(),
-                 io_movements_logger=dummy_logger()):
+                 io_movements_logger=dummy_logger(),
+                 prefetch_prices: bool = True,  # resolve all the needed prices before starting the calculation
+                 granularity: Granularity = Granularity.Minute):  # resolution of the prices, Hour and Day read much less data
         if not portfolio:
             portfolio = Portfolio()
         self.startTime = startTime
@@ -41,6 +44,10 @@ class Tassametro:
         self.deduce_fee = deduce_fee
         self.end_of_day_prices_for_all = end_of_day_prices_for_all
         self.end_of_day_prices_for_fees = end_of_day_prices_for_fees or end_of_day_prices_for_all
+        self.prefetch_prices = prefetch_prices
+        # end of day prices are the closes of the daily prices table
+        self.granularity = Granularity.Day if end_of_day_prices_for_all else granularity
+        self.fee_granularity = Granularity.Day if self.end_of_day_prices_for_fees else self.granularity
         self.fee_paid = 0
         self.IC_positions: list[Position] = []  # positions to calculate the IC tax
         """IC positions gathers all the positions that are subject to the IC tax but
@@ -55,6 +62,38 @@ class Tassametro:
     def get_quote_time(self, time: dt) -> dt:
         return time if not self.end_of_day_prices_for_all else time.replace(hour=0, minute=0, second=0, microsecond=0)
 
+    def get_fee_quote_time(self, time: dt) -> dt:
+        if self.end_of_day_prices_for_fees:
+            time = time.replace(hour=0, minute=0, second=0, microsecond=0)  # speed up conversion by taking a price approximated by day
+        return self.get_quote_time(time)
+
+    def price_requests(self, operations: list[Operation]) -> tuple[list[tuple[Symbol, dt]], list[tuple[str, str, dt]], list[tuple[str, str, dt]]]:
+        """returns the prices that processing operations will ask to the price provider:
+           the prices (symbol, time), the conversions (asset, destination asset, time) at self.granularity
+           and the conversions of the fees at self.fee_granularity"""
+        prices = []
+        conversions = []
+        fee_conversions = []
+        for op in operations:
+            if isinstance(op, Deposit):
+                prices.append((Symbol(op.asset.symbol, self.currency), self.get_quote_time(op.time)))
+            elif isinstance(op, (Withdrawal, GiftOperation, FeePayment, MarginLoan)):
+                conversions.append((op.asset.symbol, self.currency, self.get_quote_time(op.time)))
+            elif isinstance(op, ExchangeOperation):
+                if op.fee.amount != 0:
+                    fee_conversions.append((op.fee.symbol, self.currency, self.get_fee_quote_time(op.time)))
+                if op.bought.symbol in ["EUR", "USD", "USDT", "USDC", "BUSD", "DAI"]:
+                    conversions.append((op.bought.symbol, self.currency, self.get_quote_time(op.time)))
+        return prices, conversions, fee_conversions
+
+    def prefetch(self, operations: list[Operation]) -> None:
+        """resolves all the prices needed by operations so that processing them never waits for a download"""
+        prices, conversions, fee_conversions = self.price_requests(operations)
+        print(f"Prefetching {len(prices) + len(conversions) + len(fee_conversions)} prices")
+        self.prices.prefetch(prices, self.granularity)
+        self.prices.prefetch_conversions(conversions, self.granularity)
+        self.prices.prefetch_conversions(fee_conversions, self.fee_granularity)
+
     def print_state(self) -> None:
         self.portfolio.print()
         print("")
@@ -70,7 +109,7 @@ class Tassametro:
     def process_deposit(self, dep: Deposit):
         # aggiungere amount di asset al portafoglio con pc = prezzo corrente
         sym = Symbol(dep.asset.symbol, self.currency)
-        price = self.prices.get_price(sym, self.get_quote_time(dep.time))
+        price = self.prices.get_price(sym, self.get_quote_time(dep.time), self.granularity)
         if price is None:
             print(f"Price not found for {sym} at {dep.time}")
             self.io_movements_logger.info(f"Price not found for {sym} at {dep.time}, considering 0")
@@ -89,7 +128,8 @@ class Tassametro:
             asset_in_currency = self.prices.convert(
                 withdraw.asset,
                 self.currency,
-                self.get_quote_time(withdraw.time))
+                self.get_quote_time(withdraw.time),
+                self.granularity)
             if asset_in_currency is None or asset_in_currency.amount is None:
                 print(f"{withdraw.time} - Price not found for Withdrawal {withdraw.asset}")
                 self.io_movements_logger.info(f"{withdraw.time} - Price not found for Withdrawal {withdraw.asset} ")
@@ -119,7 +159,7 @@ class Tassametro:
         # the amount is added to the portfolio
         # the load price is set to the current price in 'currency'
         # the capital gain is increased by the value in 'currency' of the asset ( amout * priceInCurrency )
-        converted = self.prices.convert(gift.asset, self.currency, self.get_quote_time(gift.time))
+        converted = self.prices.convert(gift.asset, self.currency, self.get_quote_time(gift.time), self.granularity)
         if converted is None:
             print(f"{gift.time} - Price not found for Gift {gift.asset}   ")
             self.io_movements_logger.info(f"{gift.time} - Price not found for Gift {gift.asset}   ")
@@ -142,10 +182,7 @@ class Tassametro:
             fee_in_currency = trade.fee
             self.portfolio.remove(fee_in_currency)
         else:
-            conversion_time = trade.time
-            if self.end_of_day_prices_for_fees:
-                conversion_time = trade.time.replace(hour=0, minute=0, second=0, microsecond=0)  # speed up conversion by taking a price approximated by hour
-            fee_in_currency = self.prices.convert(trade.fee, self.currency, self.get_quote_time(conversion_time))
+            fee_in_currency = self.prices.convert(trade.fee, self.currency, self.get_fee_quote_time(trade.time), self.fee_granularity)
             # the fee must be exchanged to 'currency' end the expense is subject to taxation like any other
             # we will pocess the syntethic trade after adding the bought asset ( as sometimes the fee is payed in the bought asset )
             syntethicTrade = ExchangeOperation(trade.fee,  fee_in_currency, self.null_amount, trade.time)
@@ -160,7 +197,7 @@ class Tassametro:
             # then the we need to calculate capital gain
 
             # add the bought asset to the portfolio
-            bought_in_currency = self.prices.convert(trade.bought, self.currency, self.get_quote_time(trade.time))
+            bought_in_currency = self.prices.convert(trade.bought, self.currency, self.get_quote_time(trade.time), self.granularity)
             # the bought asset is added with its actual price in 'currency'
             self.portfolio.add(trade.bought, bought_in_currency.amount / trade.bought.amount, trade.time)
             # only consider the capital gain if the trade is in the period of interest
@@ -202,7 +239,7 @@ class Tassametro:
 
     def process_fee_payment(self, fee: FeePayment):
         # the amount converted to 'currency' and deducted from capital gains
-        fee_in_currency = self.prices.convert(fee.asset, self.currency, self.get_quote_time(fee.time))
+        fee_in_currency = self.prices.convert(fee.asset, self.currency, self.get_quote_time(fee.time), self.granularity)
         synthetic_trade = ExchangeOperation(fee.asset, fee_in_currency, self.null_amount, fee.time)
         self.process_trade(synthetic_trade)
         self.portfolio.remove(fee_in_currency)
@@ -212,7 +249,7 @@ class Tassametro:
             self.total_bought += fee_in_currency.amount
 
     def process_margin_loan(self, ml: MarginLoan):
-        converted = self.prices.convert(ml.asset, self.currency, self.get_quote_time(ml.time))
+        converted = self.prices.convert(ml.asset, self.currency, self.get_quote_time(ml.time), self.granularity)
         price = converted.amount / ml.asset.amount
         self.portfolio.add(ml.asset, price, ml.time)
 
@@ -241,6 +278,8 @@ class Tassametro:
     def process_operations(self, operations: list[Operation]):
         cnt = 0
         total = len(operations)
+        if self.prefetch_prices:
+            self.prefetch(operations)
         operations = list(reversed(operations))
         while len(operations) > 0:
             # lod all the operations with the same time
@@ -43,3 +43,4 @@ tassametro = Tassametro(datetime(2023, 1, 1),
 operations = operationsDb.get_operations()
 tassametro.process_operations(operations)
 tassametro.print_state()
+prices.close()
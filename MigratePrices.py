@@ -0,0 +1,18 @@
+from CriptoTassametro.PriceProvider import migrate_prices_db
+
+# converts price databases created by older versions ( prices table keyed by asset names and datetime )
+# to the current schema ( minute_prices table keyed by asset ids and epoch minute ).
+# PriceProvider migrates its database when it is opened, this script can be used to convert many files at once
+# usage:
+#   python MigratePrices.py ./data/prices.sqlite
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert price databases to the current schema')
+    parser.add_argument('files', type=str, nargs='+', help='price database files')
+    args = parser.parse_args()
+
+    for file in args.files:
+        migrated = migrate_prices_db(file)
+        print(f"{file}: {migrated} prices migrated")
@@ -1,9 +1,10 @@
 import logging
-from CriptoTassametro.BinanceHistoryParser import BinanceHistoryParser, parse_files
+from CriptoTassametro.BinanceHistoryParser import BinanceHistoryParser, HistoryColumns, parse_files
 from CriptoTassametro.PriceProvider import PriceProvider
 from CriptoTassametro.OperationsDatabase import OperationsDatabase
 from CriptoTassametro.Portfolio import Portfolio, Position
 from CriptoTassametro.Tassametro import Tassametro, setup_logger
+from CriptoTassametro.Components import Granularity
 import os
 from datetime import datetime
 
@@ -19,6 +20,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Calculate capital gain from binance history')
     parser.add_argument('session_name', type=str, help='name of the session')
     parser.add_argument('binance_history_file', type=str, help='path to the binance history csv file')
+    parser.add_argument('--offline', action='store_true', help='do not use the network, prices are taken only from the local cache')
+    parser.add_argument('--granularity', choices=[g.name for g in Granularity], default=Granularity.Minute.name,
+                        help='resolution of the prices, hour and day prices read much less data')
+    parser.add_argument('--columnar', action='store_true',
+                        help='load the whole history as numpy columns, faster but the file must fit in memory')
     args = parser.parse_args()
     
     session_name = args.session_name
@@ -34,14 +40,17 @@ if __name__ == "__main__":
 
 
     # create price provider
-    prices = PriceProvider('./data/prices.sqlite')
+    prices = PriceProvider('./data/prices.sqlite', offline=args.offline)
     # first parse binance csv files
     # if the file is huge thuis is a long process, it can be interrupted and resumed later
     # as everything is saved in a database
     operationsDb = OperationsDatabase(f'./data/{session_name}_operations.sqlite')
     opParser = BinanceHistoryParser(prices, operationsDb)
-    historyEntries = parse_files([binance_history_file])
-    opParser.parse_operations(historyEntries, binance_history_file)
+    if args.columnar:
+        opParser.parse_columns(HistoryColumns.load([binance_history_file]), binance_history_file)
+    else:
+        historyEntries = parse_files([binance_history_file])
+        opParser.parse_operations(historyEntries, binance_history_file)
     operationsDb.save()
 
     # then use the data to calculate the capital gain
@@ -55,7 +64,11 @@ if __name__ == "__main__":
                             datetime(2024, 1, 1),
                             prices, portfolio=initialPortfolio,
                             capital_gain_logger=capital_gain_logger,
-                            io_movements_logger=io_movements_logger)
+                            io_movements_logger=io_movements_logger,
+                            granularity=Granularity[args.granularity])
     operations = operationsDb.get_operations()
     tassametro.process_operations(operations)
     tassametro.print_state()
+    prices.close()
+    # counters and latencies of the price lookups, to find which tiers, assets or months are slow
+    prices.metrics.dump(f'./data/{session_name}_price_metrics.json')
@@ -1,12 +1,32 @@
  
 from CriptoTassametro.Tassametro import Tassametro, Portfolio
-from CriptoTassametro.Components import AssetAmount as AM, ExchangeOperation
-from CriptoTassametro.PriceProvider import PriceProvider
-from datetime import datetime as dt
+from CriptoTassametro.Components import AssetAmount as AM, ExchangeOperation, Deposit, Withdrawal, FeePayment, Symbol, Granularity
+from CriptoTassametro.PriceProvider import PriceProvider, migrate_prices_db
+from CriptoTassametro.Caches import LruCache
+from CriptoTassametro.RoutePlanner import RoutePlanner
+from CriptoTassametro.ArchiveDownloader import ArchiveDownloader
+from CriptoTassametro.ArchiveManifest import ArchiveManifest
+from CriptoTassametro.MinuteStore import MinuteCloseStore, epoch_minute
+from CriptoTassametro.SyntheticPriceSource import SyntheticPriceSource, synthetic_history
+from CriptoTassametro.BinanceHistoryParser import BinanceHistoryParser, HistoryColumns, HistoryEntryDecoder, HistoryEntryType, \
+    match_fills_by_amounts, min_cost_assignment, parse_files
+from CriptoTassametro.OperationsDatabase import OperationsDatabase
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+from unittest.mock import patch
+import threading
+import zipfile
+import sqlite3
+from datetime import datetime as dt, timezone
 import unittest
+import numpy as np
+import tempfile
+import shutil
+import json
+import os
 
 
-pricesDb = PriceProvider("./data/prices.db")
+pricesDb = SyntheticPriceSource(seed=1)  # no network needed
 fee = 0.001
 
 
@@ -119,6 +139,450 @@ class TestTassametro(unittest.TestCase):
 
 
 
+class TestSyntheticPriceSource(unittest.TestCase):
+    def test_deterministic_and_consistent(self):
+        prices = SyntheticPriceSource(seed=7)
+        time = dt(2023, 5, 4, 3, 2, 1)
+        btcEur = prices.get_price(Symbol("BTC", "EUR"), time)
+        self.assertEqual(btcEur, SyntheticPriceSource(seed=7).get_price(Symbol("BTC", "EUR"), time))
+        self.assertNotEqual(btcEur, SyntheticPriceSource(seed=8).get_price(Symbol("BTC", "EUR"), time))
+        # cross rates are consistent
+        self.assertAlmostEqual(btcEur, prices.get_price(Symbol("BTC", "BNB"), time) * prices.get_price(Symbol("BNB", "EUR"), time))
+        self.assertAlmostEqual(prices.convert(AM("EUR", btcEur), "BTC", time).amount, 1)
+        # prices move continuously between days
+        self.assertAlmostEqual(prices.get_price(Symbol("ETH", "USDT"), dt(2019, 3, 1, 23, 59)),
+                               prices.get_price(Symbol("ETH", "USDT"), dt(2019, 3, 2)), delta=20)
+        restricted = SyntheticPriceSource(seed=7, assets=["BTC", "EUR"])
+        self.assertIsNone(restricted.get_price(Symbol("ETH", "EUR"), time))
+        np.testing.assert_allclose(restricted.get_prices(Symbol("BTC", "EUR"), np.array([time], dtype="datetime64[us]")), [btcEur])
+
+
+class TestSymbol(unittest.TestCase):
+    def test_interned(self):
+        symbol = Symbol("BTC", "EUR")
+        self.assertIs(symbol, Symbol("BTC", "EUR"))
+        self.assertIs(symbol.reverse().reverse(), symbol)
+        self.assertNotEqual(symbol.id, symbol.reverse().id)
+        self.assertEqual((symbol.base_id, symbol.quote_id), (symbol.reverse().quote_id, symbol.reverse().base_id))
+        self.assertEqual(symbol.key, "BTCEUR")
+        with self.assertRaises(AttributeError):
+            symbol.key = "ETHEUR"
+
+
+class TestBinanceHistoryParser(unittest.TestCase):
+    def test_streaming(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        historyFile = os.path.join(folder, "history.csv")
+        lines = synthetic_history(pricesDb, dt(2023, 1, 1), 40, seed=3)
+        with open(historyFile, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        entries = parse_files([historyFile])
+        self.assertIs(iter(entries), entries)  # a generator, the file is never loaded at once
+        self.assertEqual(len(list(parse_files([historyFile], max_lines=5))), 5)
+        operationsDb = OperationsDatabase(os.path.join(folder, "operations.sqlite"))
+        BinanceHistoryParser(pricesDb, operationsDb).parse_operations(entries, historyFile)
+        operationsDb.save()
+        fills = sum(1 for line in lines if "Transaction Fee" in line)
+        operations = operationsDb.get_operations()
+        self.assertEqual(len(operations), 1 + fills)
+        self.assertEqual(sum(1 for op in operations if isinstance(op, ExchangeOperation)), fills)
+
+    def test_columns(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        historyFile = os.path.join(folder, "history.csv")
+        lines = synthetic_history(pricesDb, dt(2023, 1, 1), 40, seed=3)
+        lines.insert(2, '"111222333","2023-01-01 00:00:00","Spot","Asset Recovery","ETH","1.00000000",""')
+        with open(historyFile, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        columns = HistoryColumns.load([historyFile])
+        self.assertEqual(len(columns), len(lines) - 1)
+        self.assertEqual(columns.coins[columns.coin[0]], "EUR")
+        results = []
+        for name in ("rows", "columns"):
+            operationsDb = OperationsDatabase(os.path.join(folder, f"{name}.sqlite"))
+            parser = BinanceHistoryParser(pricesDb, operationsDb)
+            if name == "rows":
+                parser.parse_operations(parse_files([historyFile]), historyFile)
+            else:
+                parser.parse_columns(columns, historyFile)
+            operationsDb.save()
+            results.append([str(op) for op in operationsDb.get_operations()])
+        self.assertEqual(results[0], results[1])
+
+    def test_min_cost_assignment(self):
+        # a greedy choice of the cheapest pair ( 0, 0 ) would cost 101
+        self.assertEqual(min_cost_assignment([[1, 2], [2, 100]]), [1, 0])
+        costs = [[7, 3, 9, 4], [2, 8, 6, 5], [4, 4, 1, 9], [6, 2, 8, 3]]
+        assigned = min_cost_assignment(costs)
+        self.assertEqual(sorted(assigned), [0, 1, 2, 3])
+        self.assertEqual(sum(costs[i][j] for i, j in enumerate(assigned)), 9)
+
+    def test_match_fills_by_amounts(self):
+        decoder = HistoryEntryDecoder()
+        rows = [("Transaction Spend", "EUR", "-300"), ("Transaction Buy", "BTC", "0.01"), ("Transaction Fee", "BNB", "-0.0075"),
+                ("Transaction Spend", "EUR", "-600"), ("Transaction Buy", "BTC", "0.02"), ("Transaction Fee", "BTC", "-0.00002")]
+        entries = [decoder.decode(["1", "2023-01-01 10:00:01", "Spot", operation, coin, change, ""]) for operation, coin, change in rows]
+        matches = match_fills_by_amounts([entries[4], entries[1]], [entries[0], entries[3]], [entries[5], entries[2]])
+        self.assertEqual(matches, [(entries[1], entries[0], entries[2]), (entries[4], entries[3], entries[5])])
+        # fills at different prices can not be matched by amounts
+        entries[3].change = -650
+        self.assertIsNone(match_fills_by_amounts([entries[4], entries[1]], [entries[0], entries[3]], [entries[5], entries[2]]))
+
+    def test_decoder(self):
+        decoder = HistoryEntryDecoder()
+        first = decoder.decode(["1", "2023-01-01 10:00:01", "Spot", "Transaction Buy", "BTC", "0.5", ""])
+        second = decoder.decode(["1", "2023-01-01 10:00:01", "Spot", "Distribution", "ETH", "-2", "ETH to ETH2, 1:1"])
+        self.assertEqual(first.utc_time, dt(2023, 1, 1, 10, 0, 1, tzinfo=timezone.utc))
+        self.assertIs(second.utc_time, first.utc_time)  # parsed once
+        self.assertEqual((second.operation, second.change, second.remark), (HistoryEntryType.Distribution, -2, "ETH to ETH2, 1:1"))
+        with self.assertRaises(ValueError):
+            decoder.decode(["1", "2023-01-01 10:00:01", "Spot", "Unknown", "ETH", "-2", ""])
+
+
+class TestLruCache(unittest.TestCase):
+    def test_eviction_and_misses(self):
+        cache = LruCache(2)
+        cache.put("a", 1)
+        cache.put("b", None)  # misses are cached too
+        self.assertEqual(cache.lookup("a"), (True, 1))
+        cache.put("c", 3)  # "b" is the least recently used
+        self.assertEqual(cache.lookup("b"), (False, None))
+        self.assertEqual(cache.lookup("a"), (True, 1))
+        self.assertEqual(cache.lookup("c"), (True, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_size_budget(self):
+        cache = LruCache(100, lambda value: len(value))
+        cache.put("a", "x" * 60)
+        cache.put("b", "x" * 30)
+        cache.lookup("a")
+        cache.put("c", "x" * 30)  # "b" is evicted to stay within budget
+        self.assertEqual(cache.lookup("b"), (False, None))
+        self.assertEqual(cache.resident_size, 90)
+        self.assertEqual(cache.evictions, 1)
+
+
+class TestRoutePlanner(unittest.TestCase):
+    def test_fewest_hops_first_and_cached_route(self):
+        markets = {("ABC", "ETH"), ("ETH", "BNB"), ("BNB", "EUR"), ("BTC", "EUR")}
+        planner = RoutePlanner(lambda a, b, t: (a, b) in markets or (b, a) in markets)
+        routes = list(planner.candidate_routes("ABC", "EUR", dt(2023, 1, 1)))
+        self.assertEqual(routes, [["ABC", "EUR"], ["ABC", "BTC", "EUR"], ["ABC", "USDT", "EUR"], ["ABC", "ETH", "BNB", "EUR"]])
+        planner.set_route("ABC", "EUR", dt(2023, 1, 1), ["ABC", "ETH", "BNB", "EUR"])
+        self.assertEqual(next(planner.candidate_routes("ABC", "EUR", dt(2023, 1, 20))), ["ABC", "ETH", "BNB", "EUR"])
+        self.assertEqual(next(planner.candidate_routes("ABC", "EUR", dt(2023, 2, 1))), ["ABC", "EUR"])
+
+
+def write_kline_archive(folder: str, pair: str, year: int, month: int, closes: dict[dt, float], interval: str = "1m") -> None:
+    """writes a binance data monthly kline archive containing the given close prices"""
+    os.makedirs(os.path.join(folder, pair, interval), exist_ok=True)
+    name = f"{pair}-{interval}-{year}-{month:02}"
+    lines = [f"{int(t.replace(tzinfo=timezone.utc).timestamp() * 1000)},0,0,0,{c},0,0,0,0,0,0,0" for t, c in closes.items()]
+    with zipfile.ZipFile(os.path.join(folder, pair, interval, f"{name}.zip"), "w") as z:
+        z.writestr(f"{name}.csv", "\n".join(lines) + "\n")
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestArchiveDownloader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.www = os.path.join(self.dir, "www")
+        self.cache_dir = os.path.join(self.dir, "cache")
+        os.makedirs(self.cache_dir)
+        # local stand-in of data.binance.vision
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHTTPRequestHandler, directory=self.www))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def test_download_all(self):
+        write_kline_archive(self.www, "ETHBTC", 2020, 3, {dt(2020, 3, 1, 0, 1): 0.02})
+        write_kline_archive(self.www, "BNBBTC", 2020, 3, {dt(2020, 3, 1, 0, 1): 0.002})
+        downloader = ArchiveDownloader(self.cache_dir, self.base_url, maxWorkers=2, retryDelay=0)
+        progress = []
+        results = downloader.download_all(
+            [("ETHBTC", 2020, 3), ("BNBBTC", 2020, 3), ("XYZBTC", 2020, 3)],
+            lambda done, total, name: progress.append((done, total)))
+        self.assertIsNotNone(results[("ETHBTC", 2020, 3)])
+        self.assertIsNotNone(results[("BNBBTC", 2020, 3)])
+        self.assertIsNone(results[("XYZBTC", 2020, 3)])
+        self.assertEqual(progress[-1], (3, 3))
+        self.assertTrue(zipfile.is_zipfile(downloader.get_cached("ETHBTC", 2020, 3)))
+
+    def test_manifest_of_missing_archives(self):
+        write_kline_archive(self.www, "ETHBTC", 2020, 3, {dt(2020, 3, 1, 0, 1): 0.02})
+        manifestFile = os.path.join(self.cache_dir, "manifest.json")
+        downloader = ArchiveDownloader(self.cache_dir, self.base_url, retryDelay=0, manifest=ArchiveManifest(manifestFile))
+        self.assertIsNotNone(downloader.download("ETHBTC", 2020, 3))
+        self.assertIsNone(downloader.download("ETHBTC", 2020, 1))
+        self.assertIsNone(downloader.download("ETHBTC", 2020, 6))
+        downloader.manifest.save()
+        # a new manifest knows the missing archives and the months outside of the listing period without any request
+        self.server.shutdown()
+        manifest = ArchiveManifest(manifestFile)
+        self.assertTrue(manifest.is_archive_missing("ETHBTC", 2020, 1))
+        self.assertTrue(manifest.is_archive_missing("ETHBTC", 2019, 12))
+        self.assertTrue(manifest.is_archive_missing("ETHBTC", 2021, 1))
+        self.assertFalse(manifest.is_archive_missing("ETHBTC", 2020, 2))
+        self.assertFalse(manifest.is_archive_missing("ETHBTC", 2020, 4))
+
+    def test_price_from_archive(self):
+        write_kline_archive(self.www, "ETHBTC", 2020, 3, {dt(2020, 3, 2, 10, 5): 0.021})
+        # empty snapshot of active symbols, so binance api is never called
+        with open(os.path.join(self.cache_dir, "exchange_info.json"), "w") as f:
+            json.dump({"version": 1, "time": dt.now().isoformat(), "symbols": []}, f)
+        prices = PriceProvider(os.path.join(self.dir, "prices.sqlite"), self.cache_dir, archiveBaseUrl=self.base_url)
+        self.addCleanup(prices.close)
+        self.assertAlmostEqual(prices.get_price(Symbol("BTC", "ETH"), dt(2020, 3, 2, 10, 5, 30)), 1 / 0.021)
+
+    def test_day_price_from_1d_archive(self):
+        write_kline_archive(self.www, "ETHBTC", 2020, 3, {dt(2020, 3, 2): 0.021}, interval="1d")
+        with open(os.path.join(self.cache_dir, "exchange_info.json"), "w") as f:
+            json.dump({"version": 1, "time": dt.now().isoformat(), "symbols": []}, f)
+        prices = PriceProvider(os.path.join(self.dir, "prices.sqlite"), self.cache_dir, archiveBaseUrl=self.base_url)
+        self.addCleanup(prices.close)
+        self.assertAlmostEqual(prices.get_price(Symbol("ETH", "BTC"), dt(2020, 3, 3, 9), Granularity.Day), 0.021)
+        self.assertIsNone(prices.get_price(Symbol("ETH", "BTC"), dt(2020, 3, 4, 9), Granularity.Day))
+        # the minute archive is never downloaded, the store is named after the interval of its klines
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "ETHBTC-1m-2020-03.close")))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, "ETHBTC-1d-2020-03.close")))
+
+
+class StubSpot:
+    """binance api client with a kline every 10 minutes whose close is its epoch minute"""
+
+    def __init__(self):
+        self.calls = []
+
+    def klines(self, symbol: str, interval: str, startTime: int, endTime: int, limit: int) -> list:
+        self.calls.append((symbol, startTime, endTime))
+        minutes = [m for m in range(startTime // 60000, endTime // 60000 + 1) if m % 10 == 0][:limit]
+        return [[m * 60000, "0", "0", "0", str(float(m)), "0"] for m in minutes]
+
+
+class TestMinuteCloseStore(unittest.TestCase):
+    def test_as_of_lookup(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        write_kline_archive(folder, "ETHBTC", 2020, 3, {dt(2020, 3, 1, 0, 10): 1.0, dt(2020, 3, 31, 23, 59): 2.0})
+        storeFile = os.path.join(folder, "ETHBTC-1m-2020-03.close")
+        MinuteCloseStore.build_from_zip(os.path.join(folder, "ETHBTC", "1m", "ETHBTC-1m-2020-03.zip"), storeFile, 2020, 3)
+        store = MinuteCloseStore(storeFile, 2020, 3)
+        self.assertEqual(store.get(dt(2020, 3, 1, 0, 10, 40)), 1.0)
+        self.assertIsNone(store.get(dt(2020, 3, 1, 0, 50)))
+        self.assertEqual(store.get(dt(2020, 3, 1, 0, 50), maxStaleness=60), 1.0)
+        self.assertIsNone(store.get(dt(2020, 3, 1, 0, 50), maxStaleness=30))
+        self.assertIsNone(store.get(dt(2020, 3, 1, 0, 5), maxStaleness=60))
+        self.assertEqual(store.get(dt(2020, 4, 1, 0, 0), maxStaleness=1), 2.0)
+
+
+class TestPriceProvider(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "prices.sqlite")
+        self.cache_dir = os.path.join(self.dir, "cache")
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def offline_provider(self, **kwargs) -> PriceProvider:
+        prices = PriceProvider(self.db_file, self.cache_dir, offline=True, **kwargs)
+        self.addCleanup(prices.close)
+        return prices
+
+    def test_offline_uses_db_only(self):
+        prices = self.offline_provider()
+        self.assertEqual(len(prices.symbols_active), 0)
+        prices._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 1): 20000})
+        prices.close()
+        prices = self.offline_provider()
+        self.assertAlmostEqual(prices.get_price(Symbol("EUR", "BTC"), dt(2023, 1, 1)), 1 / 20000)
+        self.assertIsNone(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 2)))
+
+    def test_write_behind(self):
+        prices = self.offline_provider(flushSize=3)
+        other = self.offline_provider()
+        prices._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 1): 20000, dt(2023, 1, 2): None})
+        self.assertEqual(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 1)), 20000)
+        self.assertEqual(other._get_price_from_db(Symbol("BTC", "EUR"), epoch_minute(dt(2023, 1, 1))), (False, None))
+        prices._insert_prices(Symbol("ETH", "EUR"), {dt(2023, 1, 1): 1000})  # size threshold reached
+        self.assertEqual(other._get_price_from_db(Symbol("BTC", "EUR"), epoch_minute(dt(2023, 1, 2))), (True, None))
+        prices._insert_prices(Symbol("ETH", "EUR"), {dt(2023, 1, 2): 1100})
+        prices.close()
+        self.assertEqual(other._get_price_from_db(Symbol("ETH", "EUR"), epoch_minute(dt(2023, 1, 2))), (True, 1100))
+
+    def test_metrics(self):
+        prices = self.offline_provider()
+        prices._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 1): 20000})
+        prices.price_cache.clear()
+        for _ in range(3):
+            prices.get_price(Symbol("EUR", "BTC"), dt(2023, 1, 1))
+        self.assertEqual(prices.metrics.tier_stats("memory")["hit"]["count"], 2)
+        self.assertEqual(prices.metrics.tier_stats("db")["hit"]["count"], 1)
+        self.assertEqual(prices.metrics.tier_stats("memory")["miss"]["count"], 1)
+        self.assertEqual(prices.metrics.symbol_stats("EURBTC")["db"]["hit"]["count"], 1)
+        prices.metrics.dump(os.path.join(self.dir, "metrics.json"))
+        with open(os.path.join(self.dir, "metrics.json")) as f:
+            self.assertEqual(json.load(f)["months"]["2023-01"]["db"], {"hit": 1})
+
+    def test_get_prices(self):
+        os.makedirs(self.cache_dir)
+        closes = np.full(31 * 24 * 60, np.nan)
+        closes[10] = 4.0
+        closes.tofile(os.path.join(self.cache_dir, "ETHBTC-1m-2020-03.close"))
+        prices = self.offline_provider()
+        prices._insert_prices(Symbol("ETH", "BTC"), {dt(2020, 3, 5, 1, 2, 3): 5.0})
+        times = np.array(["2020-03-05T01:02:03", "2020-03-01T00:10:30", "2020-03-01T00:20"], dtype="datetime64[s]")
+        result = prices.get_prices(Symbol("BTC", "ETH"), times)
+        np.testing.assert_allclose(result, [0.2, 0.25, np.nan])
+
+    def test_granularity(self):
+        os.makedirs(self.cache_dir)
+        closes = np.full(31 * 24 * 60, np.nan)
+        closes[(24 + 10) * 60 + 5] = 2.0  # 2020-03-02 10:05
+        closes[2 * 24 * 60 - 1] = 3.0  # 2020-03-02 23:59
+        closes.tofile(os.path.join(self.cache_dir, "ETHBTC-1m-2020-03.close"))
+        prices = self.offline_provider()
+        self.assertEqual(prices.get_price(Symbol("ETH", "BTC"), dt(2020, 3, 3, 12), Granularity.Day), 3.0)
+        self.assertEqual(prices.get_price(Symbol("BTC", "ETH"), dt(2020, 3, 2, 11, 30), Granularity.Hour), 0.5)
+        self.assertIsNone(prices.get_price(Symbol("ETH", "BTC"), dt(2020, 3, 2, 10, 30), Granularity.Hour))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, "ETHBTC-1d-2020-03.close")))
+        prices.close()
+        with sqlite3.connect(self.db_file) as connection:
+            self.assertEqual(connection.execute("SELECT price FROM day_prices").fetchall(), [(3.0,)])
+        connection.close()
+
+    def test_merge(self):
+        prices = self.offline_provider()
+        prices._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 1): 20000})
+        others = []
+        for i in range(2):
+            other = PriceProvider(os.path.join(self.dir, f"other{i}.sqlite"), self.cache_dir, offline=True)
+            self.addCleanup(other.close)
+            other._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 1): 1, dt(2023, 1, 2 + i): 21000 + i})
+            others.append(other)
+        others[1].flush()
+        self.assertEqual(prices.merge(others[0], others[1].db.url.database), 2)
+        prices.price_cache.clear()
+        self.assertEqual(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 1)), 20000)
+        self.assertEqual(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 3)), 21001)
+
+    def test_merge_replaces_missing_prices(self):
+        prices = self.offline_provider()
+        self.assertIsNone(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 1)))  # a miss in the db and in the cache
+        other = PriceProvider(os.path.join(self.dir, "other.sqlite"), self.cache_dir, offline=True)
+        self.addCleanup(other.close)
+        other._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 1): 20000})
+        other._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 2): 20000}, Granularity.Day)
+        prices._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 2): None}, Granularity.Day)
+        self.assertEqual(prices.merge(other), 2)
+        self.assertEqual(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 1)), 20000)
+        self.assertEqual(prices.get_price(Symbol("EUR", "BTC"), dt(2023, 1, 2), Granularity.Day), 1 / 20000)
+        # actual prices are never replaced by missing ones
+        other._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 3): None})
+        prices._insert_prices(Symbol("BTC", "EUR"), {dt(2023, 1, 3): 21000})
+        self.assertEqual(prices.merge(other), 0)
+        self.assertEqual(prices.get_price(Symbol("BTC", "EUR"), dt(2023, 1, 3)), 21000)
+
+    def test_migrate_legacy_db(self):
+        with sqlite3.connect(self.db_file) as connection:
+            connection.execute("CREATE TABLE prices (asset VARCHAR, quoteAsset VARCHAR, time DATETIME, price FLOAT, "
+                               "PRIMARY KEY (asset, quoteAsset, time))")
+            connection.executemany("INSERT INTO prices VALUES (?, ?, ?, ?)", [
+                ("BTC", "EUR", "2023-01-01 00:00:00.000000", 20000),
+                ("BTC", "EUR", "2023-01-01 00:00:30.000000", None),
+                ("ETH", "BTC", "2023-01-01 00:01:00.000000", None)])
+        connection.close()
+        self.assertEqual(migrate_prices_db(self.db_file), 2)
+        self.assertEqual(migrate_prices_db(self.db_file), 0)
+        prices = self.offline_provider()
+        self.assertEqual(prices.get_price(Symbol("EUR", "BTC"), dt(2023, 1, 1, 0, 0, 45)), 1 / 20000)
+        self.assertEqual(prices._get_price_from_db(Symbol("ETH", "BTC"), epoch_minute(dt(2023, 1, 1, 0, 1))), (True, None))
+
+    def test_day_price_from_migrated_minute_prices(self):
+        with sqlite3.connect(self.db_file) as connection:
+            connection.execute("CREATE TABLE prices (asset VARCHAR, quoteAsset VARCHAR, time DATETIME, price FLOAT, "
+                               "PRIMARY KEY (asset, quoteAsset, time))")
+            connection.execute("INSERT INTO prices VALUES ('BNB', 'EUR', '2023-03-05 00:00:00.000000', 150)")
+        connection.close()
+        prices = self.offline_provider()
+        # fees are converted at the close of the previous day with the default settings
+        tassametro = Tassametro(dt(2023, 1, 1), dt(2023, 12, 31), prices, Portfolio())
+        tassametro.process_operations([ExchangeOperation(AM("EUR", 1500), AM("BNB", 10), AM("BNB", 0.1), dt(2023, 3, 5, 10))])
+        self.assertAlmostEqual(tassametro.fee_paid, 15.0)
+        prices.close()
+        with sqlite3.connect(self.db_file) as connection:
+            self.assertEqual(connection.execute("SELECT price FROM day_prices").fetchall(), [(150.0,)])
+        connection.close()
+
+    def test_no_lookups_after_prefetch(self):
+        os.makedirs(self.cache_dir)
+        for pair, price in (("BTCEUR", 20000.0), ("BNBEUR", 300.0)):
+            np.full(31 * 24 * 60, price).tofile(os.path.join(self.cache_dir, f"{pair}-1m-2023-03.close"))
+        prices = self.offline_provider()
+        operations = [
+            Deposit("BTC", 1, dt(2023, 3, 2, 9)),
+            ExchangeOperation(AM("EUR", 3000), AM("BNB", 10), AM("BNB", 0.01), dt(2023, 3, 3, 10)),
+            ExchangeOperation(AM("BTC", 0.5), AM("EUR", 10000), AM("BNB", 0.02), dt(2023, 3, 5, 11, 30)),
+            Withdrawal("BTC", 0.2, dt(2023, 3, 6, 12)),
+            FeePayment("BNB", 0.1, dt(2023, 3, 7, 13)),
+        ]
+        tassametro = Tassametro(dt(2023, 1, 1), dt(2023, 12, 31), prices, Portfolio(), prefetch_prices=False)
+        tassametro.prefetch(operations)
+        misses = prices.metrics.memory_misses
+        # every price asked while processing the operations was resolved by the prefetch
+        tassametro.process_operations(operations)
+        self.assertEqual(prices.metrics.memory_misses, misses)
+        self.assertGreater(prices.metrics.memory_hits, 0)
+        self.assertAlmostEqual(tassametro.fee_paid, 0.13 * 300)
+
+    def test_markets_by_month(self):
+        prices = self.offline_provider()
+        prices.manifest.set_listing("BNBETH", epoch_minute(dt(2020, 6, 1)), None)
+        prices.manifest.add_missing_archive("BNBEUR", 2021, 1)
+        self.assertFalse(prices.has_market("ETH", "BNB", dt(2020, 3, 1)))
+        self.assertTrue(prices.has_market("ETH", "BNB", dt(2020, 7, 1)))
+        self.assertFalse(prices.has_market("EUR", "BNB", dt(2021, 1, 10)))
+        self.assertNotIn(["ETH", "BNB", "EUR"], list(prices.route_planner.candidate_routes("ETH", "EUR", dt(2020, 3, 1))))
+        self.assertIn(["ETH", "BNB", "EUR"], list(prices.route_planner.candidate_routes("ETH", "EUR", dt(2020, 7, 1))))
+
+    def test_rest_kline_windows(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, "exchange_info.json"), "w") as f:
+            json.dump({"version": 1, "time": dt.now().isoformat(), "symbols": ["BTCEUR"]}, f)
+        with patch("CriptoTassametro.PriceProvider.Spot", StubSpot):
+            prices = PriceProvider(self.db_file, self.cache_dir)
+        self.addCleanup(prices.close)
+        prices.manifest.set_listing("BTCEUR", 0, None)
+        # the window starts 6 hours before the first time and holds 1000 klines
+        times = [dt(2023, 3, 1, 12, 5), dt(2023, 3, 1, 12, 37), dt(2023, 3, 1, 18), dt(2023, 3, 1, 22, 44)]
+        for time in times:
+            # the price is the last close in the 6 hours look-back, there is a kline every 10 minutes
+            minute = epoch_minute(time) // 10 * 10
+            self.assertEqual(prices.get_price(Symbol("BTC", "EUR"), time), minute)
+        self.assertEqual(len(prices.client.calls), 1)
+        # nearby times are downloaded with a single call, a time out of the windows needs another one
+        prices.prefetch([(Symbol("BTC", "EUR"), dt(2023, 3, 1, 22, 50)), (Symbol("BTC", "EUR"), dt(2023, 3, 2, 3))])
+        self.assertEqual(len(prices.client.calls), 2)
+        self.assertEqual(prices.client.calls[1][1], (epoch_minute(dt(2023, 3, 1, 22, 50)) - 360) * 60000)
+        # klines are never asked after the last completed minute
+        prices.get_price(Symbol("BTC", "EUR"), dt.now(timezone.utc))
+        self.assertLess(prices.client.calls[-1][2], dt.now(timezone.utc).timestamp() * 1000)
+
+    def test_offline_exchange_info_snapshot(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, "exchange_info.json"), "w") as f:
+            json.dump({"version": 1, "time": dt(2020, 1, 1).isoformat(), "symbols": ["BTCEUR"]}, f)
+        prices = self.offline_provider()
+        self.assertEqual(prices.symbols_active, {"BTCEUR"})
+
+
 if __name__ == '__main__':
     #t = TestTassametro()
     #t.setUp()
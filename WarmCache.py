@@ -0,0 +1,69 @@
+from CriptoTassametro.BinanceHistoryParser import BinanceHistoryParser, parse_files
+from CriptoTassametro.PriceProvider import PriceProvider
+from CriptoTassametro.OperationsDatabase import OperationsDatabase
+from CriptoTassametro.Portfolio import Portfolio
+from CriptoTassametro.Tassametro import Tassametro
+from CriptoTassametro.Components import Granularity
+from datetime import datetime
+
+# downloads in parallel all the binance data archives that will be needed to calculate the capital gain,
+# so that the calculation does not need to wait for downloads
+# usage:
+#   python WarmCache.py history binance_history.csv
+#   python WarmCache.py operations ./data/session_operations.sqlite
+#   python WarmCache.py operations ./data/session_operations.sqlite --granularity Day
+
+
+def conversions_from_history(file: str, tassametro: Tassametro) -> dict[Granularity, list[tuple[str, str, datetime]]]:
+    """the conversions of the history entries grouped by the granularity of their prices, fees have their own"""
+    groups = {tassametro.granularity: []}
+    for entry in parse_files([file]):
+        if entry.coin == tassametro.currency:
+            continue
+        if entry.operation in BinanceHistoryParser.exchange_fee_types:
+            groups.setdefault(tassametro.fee_granularity, []).append((entry.coin, tassametro.currency, entry.utc_time))
+        else:
+            groups[tassametro.granularity].append((entry.coin, tassametro.currency, entry.utc_time))
+    return groups
+
+
+def conversions_from_operations(file: str, tassametro: Tassametro) -> dict[Granularity, list[tuple[str, str, datetime]]]:
+    """the conversions of the operations grouped by the granularity of their prices"""
+    operations = OperationsDatabase(file).get_operations()
+    prices, conversions, fee_conversions = tassametro.price_requests(operations)
+    groups = {tassametro.granularity: conversions + [(symbol.baseAsset, symbol.quoteAsset, time) for symbol, time in prices]}
+    groups.setdefault(tassametro.fee_granularity, []).extend(fee_conversions)
+    return groups
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Download the binance data archives needed for a calculation')
+    parser.add_argument('source', choices=['history', 'operations'], help='type of the file to scan')
+    parser.add_argument('file', type=str, help='binance history csv file or operations database')
+    parser.add_argument('--workers', type=int, default=8, help='number of parallel downloads')
+    parser.add_argument('--base-url', type=str, default=None, help='base url of the kline archives')
+    parser.add_argument('--granularity', choices=[g.name for g in Granularity], default=Granularity.Minute.name,
+                        help='resolution of the prices, day runs download only the small 1d archives')
+    args = parser.parse_args()
+
+    kwargs = {'downloadWorkers': args.workers}
+    if args.base_url is not None:
+        kwargs['archiveBaseUrl'] = args.base_url
+    prices = PriceProvider('./data/prices.sqlite', **kwargs)
+
+    tassametro = Tassametro(datetime.min, datetime.max, prices, Portfolio(), granularity=Granularity[args.granularity])
+    if args.source == 'history':
+        groups = conversions_from_history(args.file, tassametro)
+    else:
+        groups = conversions_from_operations(args.file, tassametro)
+    for granularity, conversions in groups.items():
+        archives = prices.archives_for_conversions(conversions, granularity)
+        print(f"{len(archives)} {granularity.interval} archives needed")
+        results = prices.download_archives(
+            archives,
+            lambda done, total, name: print(f"[{done}/{total}] {name}"),
+            granularity)
+        missing = [archive for archive, file in results.items() if file is None]
+        print(f"Downloaded {len(results) - len(missing)} archives, {len(missing)} not available")
+    prices.close()